@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Tracks cold-start cost of the simulator: interpreter start plus importing
+sim, a whole zero-round run from the command line, and loading plus
+constructing the agents in-process.
+
+Usage: bench_startup.py [--reps N] [--peers N] [AgentClass ...]
+"""
+
+import os
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+from util import Params, load_modules, mean
+
+
+def time_command(cmd, reps):
+    """Run cmd reps times, return the wall times in seconds."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for i in range(reps):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=here, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def time_construction(class_names, reps):
+    """Time load_modules plus building every peer, in-process."""
+    times = []
+    for i in range(reps):
+        start = time.perf_counter()
+        config = Params()
+        config.add("agent_class_names", class_names)
+        config.add("agent_classes", load_modules(class_names))
+        config.add("num_pieces", 128)
+        config.add("blocks_per_piece", 32)
+        config.add("max_up_bw", 10)
+        classes = config.agent_classes
+        peers = [classes[name](config, "%s%d" % (name, j), [0]*128, 10)
+                 for (j, name) in enumerate(class_names)]
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options] AgentClass ...")
+    parser.add_option("--reps", dest="reps", default=10, type="int",
+                      help="Number of repetitions of each measurement")
+    parser.add_option("--peers", dest="peers", default=100, type="int",
+                      help="Number of peers of each class to construct")
+    (options, args) = parser.parse_args(args[1:])
+
+    agents = args or ["TodoketeStd", "TodoketeTyrant", "Seed"]
+    agent_args = ["%s,%d" % (a, options.peers) for a in agents]
+    class_names = []
+    for a in agents:
+        class_names.extend([a]*options.peers)
+
+    def report(name, times):
+        print("%-24s mean %7.1f ms  min %7.1f ms" % (
+            name, 1000 * mean(times), 1000 * min(times)))
+
+    report("interpreter", time_command([sys.executable, "-c", "pass"],
+                                       options.reps))
+    report("import sim", time_command([sys.executable, "-c", "import sim"],
+                                      options.reps))
+    report("sim.py --max-round=0",
+           time_command([sys.executable, "sim.py", "--loglevel=warning",
+                         "--max-round=0"] + agent_args, options.reps))
+    report("load + construct %d" % len(class_names),
+           time_construction(class_names, options.reps))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
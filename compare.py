@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+"""
+Paired comparison of two agent mixes with common random numbers.
+
+  python compare.py [sim.py options] MIX_A vs MIX_B
+  e.g.  python compare.py --iters=30 --seed=1 TodoketeStd,5 Seed,1 vs TodoketeTyrant,5 Seed,1
+
+Both mixes are run for --iters iterations with sim.py --crn-seed, so in
+iteration i the n-th peer has the same upload bandwidth under both mixes,
+and both start from the same random state.  The mixes must have the same
+number of peers; the "focal" peers are the positions where their classes
+differ.  Each iteration gives one paired difference B - A of:
+
+  focal completion   mean completion round of the focal peers
+  focal uploaded     mean blocks uploaded by the focal peers
+  all completion     mean completion round of all the non-seed peers
+
+The report has the 95% confidence interval of the mean difference, the
+interval an unpaired comparison of the same runs would give, and the
+variance reduction: how many times more iterations independent runs
+would need for the same interval.  Peers that don't finish count as
+finishing in round max_round + 1.
+
+--independent draws the two mixes independently (different seeds) for
+comparison.
+"""
+
+import sys
+import math
+
+from sim import Sim, make_parser, make_config, parse_agents, configure_logging
+from stats import Stats
+from util import RunningStat, t95
+
+METRICS = ["focal completion", "focal uploaded", "all completion"]
+
+
+class IterationRecorder:
+    """Sim observer that keeps every peer's results, in peer order."""
+    def __init__(self):
+        self.iterations = []    # [(uploaded list, completion list)]
+
+    def end_iteration(self, sim, history):
+        ids = sim.peer_ids
+        uploaded = Stats.uploaded_blocks(ids, history)
+        completion = Stats.completion_rounds(ids, history)
+        self.iterations.append(([uploaded[pid] for pid in ids],
+                                [completion[pid] for pid in ids]))
+
+
+def run_mix(options, agents, seed, crn):
+    options.seed = seed
+    options.crn_seed = seed if crn else None
+    options.target_ci = None    # both mixes need the same iterations
+    sim = Sim(make_config(options, agents))
+    recorder = IterationRecorder()
+    sim.add_observer(recorder)
+    sim.run_sim()
+    return recorder.iterations
+
+
+def metrics(agents, focal, iteration, max_round):
+    """dict metric -> value for one mix and iteration"""
+    (uploaded, completion) = iteration
+    done = [max_round + 1 if c is None else c for c in completion]
+    mean = lambda xs: sum(xs) / float(len(xs)) if xs else 0.0
+    peers = [h for h in range(len(agents)) if not agents[h].startswith("Seed")]
+    return {"focal completion": mean([done[h] for h in focal]),
+            "focal uploaded": mean([uploaded[h] for h in focal]),
+            "all completion": mean([done[h] for h in peers])}
+
+
+class PairedStat:
+    """Both sides and their paired differences."""
+    def __init__(self):
+        self.a = RunningStat()
+        self.b = RunningStat()
+        self.diff = RunningStat()
+
+    def add(self, a, b):
+        self.a.add(a)
+        self.b.add(b)
+        self.diff.add(b - a)
+
+    def sample_var(self, s):
+        return s.m2 / (s.n - 1) if s.n > 1 else 0.0
+
+    def unpaired_ci95(self):
+        """Half-width for the difference of the means of independent runs."""
+        n = self.diff.n
+        if n < 2:
+            return None
+        return t95(2 * n - 2) * math.sqrt(
+            (self.sample_var(self.a) + self.sample_var(self.b)) / n)
+
+    def reduction(self):
+        """Var(A) + Var(B) over Var(B - A), or None if there's no variance."""
+        v = self.sample_var(self.diff)
+        if v == 0:
+            return None
+        return (self.sample_var(self.a) + self.sample_var(self.b)) / v
+
+
+def report(stats, out=None):
+    out = out or sys.stdout
+    fmt = lambda v: "-" if v is None else "%.2f" % v
+    out.write("%-18s %9s %9s %9s %10s %12s %10s\n" % (
+        "", "A", "B", "B - A", "+/- paired", "+/- unpaired", "reduction"))
+    for m in METRICS:
+        s = stats[m]
+        r = s.reduction()
+        out.write("%-18s %9.2f %9.2f %+9.2f %10s %12s %10s\n" % (
+            m, s.a.mean(), s.b.mean(), s.diff.mean(), fmt(s.diff.ci95()),
+            fmt(s.unpaired_ci95()), "-" if r is None else "%.1fx" % r))
+
+
+def main(args):
+    parser = make_parser()
+    parser.set_usage("Usage: %prog [sim.py options] PeerClass[,count] ... vs PeerClass[,count] ...")
+    parser.set_defaults(loglevel="error", iters=30, seed=0)
+    parser.add_option("--independent", dest="independent", default=False,
+                      action="store_true",
+                      help="Draw the two mixes independently instead of with common random numbers")
+    (options, args) = parser.parse_args(args[1:])
+    if args.count("vs") != 1:
+        parser.error("Give two agent mixes separated by 'vs'")
+    i = args.index("vs")
+    try:
+        a = parse_agents(args[:i])
+        b = parse_agents(args[i+1:])
+    except ValueError as e:
+        parser.error(str(e))
+    if len(a) != len(b) or not a:
+        parser.error("The mixes must have the same number of peers")
+    focal = [h for h in range(len(a)) if a[h] != b[h]]
+    if not focal:
+        parser.error("The mixes are the same")
+
+    configure_logging(options.loglevel)
+    seed = options.seed
+    crn = not options.independent
+    runs_a = run_mix(options, a, seed, crn)
+    runs_b = run_mix(options, b, seed if crn else seed + 1, crn)
+
+    stats = dict((m, PairedStat()) for m in METRICS)
+    for (it_a, it_b) in zip(runs_a, runs_b):
+        ma = metrics(a, focal, it_a, options.max_round)
+        mb = metrics(b, focal, it_b, options.max_round)
+        for m in METRICS:
+            stats[m].add(ma[m], mb[m])
+
+    n = len(runs_a)
+    print("%s comparison over %d iterations (seed %d)" % (
+        "Paired (common random numbers)" if crn else "Independent", n, seed))
+    print("  A: %s" % " ".join(args[:i]))
+    print("  B: %s" % " ".join(args[i+1:]))
+    print("  Focal peers: the %d of %d positions where the mixes differ" % (
+        len(focal), len(a)))
+    report(stats)
+
+if __name__ == "__main__":
+    main(sys.argv)
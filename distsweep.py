@@ -0,0 +1,432 @@
+#!/usr/bin/python
+
+"""
+Distributed sweeps: a coordinator hands out work units to workers on any
+number of machines over plain TCP, and merges what comes back.
+
+  python distsweep.py [--port=N] [--unit-size=N] [--sweep=NAME=V1,V2 ...]
+      [--local-workers=N] [--out=FILE] -- [sim.py options] PeerClass[,count] ...
+  python distsweep.py --worker=HOST:PORT
+
+The sweep is simservice.py's job: sim.py's arguments, run once for every
+combination of the --sweep values.  Each run's --iters iterations are
+independent single-iteration simulations seeded --seed, --seed + 1, ...
+(--seed defaults to 0), so a run's results don't depend on which worker
+ran what.  A work unit is a run and a range of --unit-size seeds.
+
+Workers send a compact summary of every iteration (per-peer uploaded
+blocks and completion rounds, end reason, blocks wasted and transferred)
+and a heartbeat while they work, with the number of rounds simulated so
+far.  A worker that disconnects, sends a message that doesn't make sense,
+or doesn't get any further (no new round and no iteration) for --timeout
+seconds is dropped and its unit handed to another; results that arrive
+twice are only counted once.  The coordinator folds
+each run's iterations into a RunSummary in seed order and logs it like
+sim.py does, and with --out also writes the per-class results as JSON.
+
+--local-workers starts that many worker processes on this machine, which
+is also how to try it all out on one box.
+
+Protocol: one JSON object per line.
+  worker -> coordinator  {"type": "hello", "host": ...}
+                         {"type": "iteration", "unit": id, "seed": s,
+                          "peer_ids": [...], "uploaded": [...],
+                          "completion": [...], "end_reason": ...,
+                          "wasted": w, "delivered": d}
+                         {"type": "unit_done", "unit": id}
+                         {"type": "error", "unit": id, "message": ...}
+                         {"type": "heartbeat", "rounds": n}
+  coordinator -> worker  {"type": "unit", "unit": id, "args": [...],
+                          "params": {...}, "seeds": [first, last + 1]}
+                         {"type": "stop"}
+"""
+
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import subprocess
+import threading
+from optparse import OptionParser
+
+from sim import Sim, make_config, log_summary, configure_logging
+from simservice import parse_job, parse_sweep, JobError
+from stats import Stats, RunSummary
+
+HEARTBEAT = 5   # seconds between worker heartbeats
+
+
+# Worker
+
+class IterationCollector:
+    """Sim observer that keeps the compact summary of each iteration."""
+    def __init__(self):
+        self.iterations = []
+
+    def end_iteration(self, sim, history):
+        ids = sim.peer_ids
+        uploaded = Stats.uploaded_blocks(ids, history)
+        completion = Stats.completion_rounds(ids, history)
+        self.iterations.append({
+            "peer_ids": ids,
+            "uploaded": [uploaded[pid] for pid in ids],
+            "completion": [completion[pid] for pid in ids],
+            "end_reason": history.end_reason,
+            "wasted": sum(history.round_wasted),
+            "delivered": sum(history.round_blocks)})
+
+
+def run_seed(options, agents, seed, observer=None):
+    """One single-iteration simulation; its compact summary."""
+    options.iters = 1
+    options.seed = seed
+    sim = Sim(make_config(options, agents))
+    collector = IterationCollector()
+    sim.add_observer(collector)
+    if observer is not None:
+        sim.add_observer(observer)
+    sim.run_sim()
+    return collector.iterations[0]
+
+
+class Worker:
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.lock = threading.Lock()    # the heartbeat thread sends too
+        self.done = threading.Event()
+        self.rounds = 0     # rounds simulated, reported in heartbeats
+
+    def send(self, msg):
+        with self.lock:
+            self.sock.sendall(json.dumps(msg).encode() + b"\n")
+
+    def heartbeat(self):
+        while not self.done.wait(HEARTBEAT):
+            try:
+                self.send({"type": "heartbeat", "rounds": self.rounds})
+            except OSError:
+                return
+
+    def run(self):
+        self.send({"type": "hello", "host": socket.gethostname()})
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+        try:
+            for line in self.sock.makefile("rb"):
+                msg = json.loads(line)
+                if msg["type"] == "stop":
+                    break
+                elif msg["type"] == "unit":
+                    self.run_unit(msg)
+        finally:
+            self.done.set()
+            self.sock.close()
+
+    def run_unit(self, msg):
+        seed = None
+        try:
+            sweep = dict((k, [v]) for (k, v) in msg["params"].items())
+            [(options, agents, params)] = parse_job({"args": msg["args"],
+                                                     "sweep": sweep})
+            for seed in range(*msg["seeds"]):
+                it = run_seed(options, agents, seed, self)
+                self.send(dict(it, type="iteration", unit=msg["unit"], seed=seed))
+        except Exception as e:
+            # Another worker would fail the same way
+            where = "job" if seed is None else "seed %d" % seed
+            self.send({"type": "error", "unit": msg.get("unit"),
+                       "message": "%s: %s: %s" % (where, type(e).__name__, e)})
+        else:
+            self.send({"type": "unit_done", "unit": msg["unit"]})
+
+    # Sim observer interface, so heartbeats show the simulation moves on
+
+    def end_round(self, sim, round, history, completed):
+        self.rounds += 1
+
+
+def run_worker(address):
+    (host, _, port) = address.rpartition(":")
+    # The coordinator may still be starting up
+    for attempt in range(50):
+        try:
+            worker = Worker(host or "127.0.0.1", int(port))
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.2)
+    else:
+        raise SystemExit("Can't connect to the coordinator at %s" % address)
+    # sim.py's summaries are the coordinator's business
+    logging.getLogger().setLevel(logging.ERROR)
+    worker.run()
+
+
+# Coordinator
+
+class RunResults:
+    """The iterations of one run, folded into a RunSummary in seed order."""
+    def __init__(self, params, agents, first_seed):
+        self.params = params
+        self.agents = agents
+        self.next_seed = first_seed
+        self.pending = dict()   # seed -> iteration, waiting for earlier seeds
+        self.peer_ids = None    # as the first iteration that came in had them
+        self.summary = None
+
+    def check(self, it, first, last):
+        """Raise ValueError unless it is an iteration message for a seed in
+        [first, last) that can be folded in."""
+        number = lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)
+        seed = it.get("seed")
+        if not isinstance(seed, int) or not first <= seed < last:
+            raise ValueError("seed %r isn't in the unit" % (seed,))
+        ids = it.get("peer_ids")
+        if not isinstance(ids, list) or len(ids) != len(self.agents):
+            raise ValueError("bad peer_ids")
+        if self.peer_ids is not None and ids != self.peer_ids:
+            raise ValueError("peer_ids differ from earlier iterations")
+        uploaded = it.get("uploaded")
+        completion = it.get("completion")
+        if (not isinstance(uploaded, list) or len(uploaded) != len(ids)
+                or not all(number(v) for v in uploaded)):
+            raise ValueError("bad uploaded")
+        if (not isinstance(completion, list) or len(completion) != len(ids)
+                or not all(v is None or number(v) for v in completion)):
+            raise ValueError("bad completion")
+        if not isinstance(it.get("end_reason"), str):
+            raise ValueError("bad end_reason")
+        if not number(it.get("wasted")) or not number(it.get("delivered")):
+            raise ValueError("bad wasted or delivered")
+        self.peer_ids = ids
+
+    def add(self, seed, it):
+        if seed < self.next_seed or seed in self.pending:
+            return  # a reassigned unit's duplicate
+        self.pending[seed] = it
+        while self.next_seed in self.pending:
+            it = self.pending.pop(self.next_seed)
+            ids = it["peer_ids"]
+            if self.summary is None:
+                self.summary = RunSummary(ids, self.agents)
+            self.summary.add_iteration(dict(zip(ids, it["uploaded"])),
+                                       dict(zip(ids, it["completion"])),
+                                       it["end_reason"], it["wasted"],
+                                       it["delivered"])
+            self.next_seed += 1
+
+
+class Coordinator:
+    def __init__(self, job, unit_size, timeout):
+        self.timeout = timeout
+        self.job_args = job["args"]
+        self.runs = []
+        self.units = asyncio.Queue()    # (unit id, run, first seed, last seed + 1)
+        self.remaining = set()          # unit ids not done yet
+        unit_id = 0
+        for (options, agents, params) in parse_job(job):
+            first = options.seed if options.seed is not None else 0
+            run = len(self.runs)
+            self.runs.append(RunResults(params, agents, first))
+            for s in range(first, first + options.iters, unit_size):
+                unit = (unit_id, run, s, min(s + unit_size, first + options.iters))
+                self.units.put_nowait(unit)
+                self.remaining.add(unit_id)
+                unit_id += 1
+        self.total_units = unit_id
+        self.error = None               # why the sweep failed, if it did
+        self.connections = set()        # handle() tasks
+        self.finished = asyncio.Event()
+        if not self.remaining:
+            self.finished.set()
+
+    async def next_unit(self):
+        """The next unit to hand out, or None once everything is done."""
+        get = asyncio.ensure_future(self.units.get())
+        fin = asyncio.ensure_future(self.finished.wait())
+        (done, _) = await asyncio.wait([get, fin],
+                                       return_when=asyncio.FIRST_COMPLETED)
+        fin.cancel()
+        if get in done:
+            return get.result()
+        get.cancel()
+        return None
+
+    async def handle(self, reader, writer):
+        peer = "%s:%s" % writer.get_extra_info("peername")[:2]
+        unit = None
+        loop = asyncio.get_running_loop()
+        async def receive(deadline=None):
+            """The next message; TimeoutError once the deadline is past."""
+            wait = self.timeout if deadline is None else deadline - loop.time()
+            line = await asyncio.wait_for(reader.readline(), max(0, wait))
+            if not line:
+                raise ConnectionError("disconnected")
+            msg = json.loads(line)
+            if not isinstance(msg, dict) or not isinstance(msg.get("type"), str):
+                raise ValueError("not a message: %r" % line[:80])
+            return msg
+        def send(msg):
+            writer.write(json.dumps(msg).encode() + b"\n")
+
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            hello = await receive()
+            if hello["type"] != "hello":
+                raise ValueError("expected hello, got %s" % hello["type"])
+            name = "%s at %s" % (hello.get("host"), peer)
+            logging.info("Worker %s connected" % name)
+            while True:
+                unit = await self.next_unit()
+                if unit is None:
+                    send({"type": "stop"})
+                    await writer.drain()
+                    break
+                (unit_id, run, first, last) = unit
+                r = self.runs[run]
+                send({"type": "unit", "unit": unit_id, "args": self.job_args,
+                      "params": r.params, "seeds": [first, last]})
+                await writer.drain()
+                # Heartbeats alone don't count: the worker has to get further
+                deadline = loop.time() + self.timeout
+                rounds = None
+                while True:
+                    msg = await receive(deadline)
+                    if msg["type"] == "heartbeat":
+                        if msg.get("rounds") != rounds:
+                            rounds = msg.get("rounds")
+                            deadline = loop.time() + self.timeout
+                        continue
+                    if msg.get("unit") != unit_id:
+                        raise ValueError("message for unit %r during unit %d" % (
+                            msg.get("unit"), unit_id))
+                    if msg["type"] == "iteration":
+                        r.check(msg, first, last)
+                        r.add(msg["seed"], msg)
+                        deadline = loop.time() + self.timeout
+                    elif msg["type"] == "unit_done":
+                        break
+                    elif msg["type"] == "error":
+                        self.error = "Unit %d failed on %s: %s" % (
+                            unit_id, name, msg.get("message"))
+                        self.finished.set()
+                        break
+                    else:
+                        raise ValueError("unexpected %s message" % msg["type"])
+                self.unit_done(unit_id, name)
+                unit = None
+        except asyncio.CancelledError:
+            pass    # shutting down while a worker still works on a duplicate
+        except Exception as e:
+            # Whatever went wrong, the unit goes to another worker
+            logging.warning("Lost worker %s: %s" % (peer, str(e) or type(e).__name__))
+            if unit is not None and unit[0] in self.remaining:
+                self.units.put_nowait(unit)
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    def unit_done(self, unit_id, worker):
+        if unit_id not in self.remaining:
+            return
+        self.remaining.discard(unit_id)
+        logging.info("Unit %d done by %s, %d of %d left" % (
+            unit_id, worker, len(self.remaining), self.total_units))
+        if not self.remaining:
+            self.finished.set()
+
+    def report(self, out=None):
+        results = []
+        for (i, r) in enumerate(self.runs):
+            logging.warning("======== RUN %d: %s ========" % (
+                i, ", ".join("%s=%s" % kv for kv in sorted(r.params.items()))))
+            s = r.summary
+            if s is None:
+                # A run with no iterations
+                logging.warning("No iterations")
+                results.append({"params": r.params, "iters": 0,
+                                "end_reasons": {}, "classes": {}})
+                continue
+            log_summary(s)
+            classes = dict()
+            for c in s.classes:
+                completion = s.class_completion[c]
+                classes[c] = {
+                    "uploaded": s.class_uploaded[c].mean(),
+                    "uploaded_ci95": s.class_uploaded[c].ci95(),
+                    "completion": None if completion is None else completion.mean(),
+                    "completion_ci95": None if completion is None else completion.ci95()}
+            results.append({"params": r.params, "iters": s.iters,
+                            "end_reasons": s.end_reasons, "classes": classes})
+        if out is not None:
+            with open(out, "w") as f:
+                json.dump(results, f, indent=1)
+
+
+async def coordinate(options, job):
+    coord = Coordinator(job, options.unit_size, options.timeout)
+    server = await asyncio.start_server(coord.handle, options.host, options.port)
+    port = server.sockets[0].getsockname()[1]
+    logging.warning("Coordinator on %s:%d: %d runs, %d units" % (
+        options.host, port, len(coord.runs), coord.total_units))
+    local = [subprocess.Popen([sys.executable, __file__,
+                               "--worker=127.0.0.1:%d" % port])
+             for i in range(options.local_workers)]
+    try:
+        async with server:
+            await coord.finished.wait()
+            # Let idle workers get their stop message
+            if coord.connections:
+                await asyncio.wait(list(coord.connections), timeout=1)
+    finally:
+        for p in local:
+            try:
+                p.wait(timeout=HEARTBEAT)
+            except subprocess.TimeoutExpired:
+                p.kill()
+    if coord.error is not None:
+        raise JobError(coord.error)
+    coord.report(options.out)
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options] -- [sim.py options] PeerClass[,count] ...\n"
+                          "       %prog --worker=HOST:PORT")
+    parser.add_option("--worker", dest="worker", default=None,
+                      help="Work for the coordinator at HOST:PORT")
+    parser.add_option("--host", dest="host", default="0.0.0.0",
+                      help="Address the coordinator listens on")
+    parser.add_option("--port", dest="port", default=0, type="int",
+                      help="Port the coordinator listens on (0: any free port)")
+    parser.add_option("--unit-size", dest="unit_size", default=10, type="int",
+                      help="Iterations (seeds) per work unit")
+    parser.add_option("--timeout", dest="timeout", default=60, type="float",
+                      help="Seconds without progress (a new round or iteration) from a worker before its unit is reassigned")
+    parser.add_option("--sweep", dest="sweep", default=[], action="append",
+                      help="Run the simulation for each value: NAME=V1,V2,...")
+    parser.add_option("--local-workers", dest="local_workers", default=0, type="int",
+                      help="Start this many workers on this machine")
+    parser.add_option("--out", dest="out", default=None,
+                      help="Also write the per-class results as JSON to this file")
+    parser.add_option("--loglevel", dest="loglevel", default="info",
+                      help="Logging level of the coordinator")
+    (options, args) = parser.parse_args(args[1:])
+    if options.unit_size < 1:
+        parser.error("--unit-size must be at least 1")
+
+    if options.worker is not None:
+        run_worker(options.worker)
+        return
+
+    configure_logging(options.loglevel)
+    job = {"args": args}
+    if options.sweep:
+        job["sweep"] = parse_sweep(options.sweep)
+    try:
+        asyncio.run(coordinate(options, job))
+    except JobError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,8 +1,5 @@
 #!/usr/bin/python
 
-import copy
-import pprint
-
 
 class AgentHistory:
     """
@@ -31,6 +28,9 @@ class AgentHistory:
         return len(self.downloads)
 
     def __repr__(self):
+        # Imported here: pprint adds about 5 ms (close to a tenth) to the
+        # start of every run, and only debugging output needs it
+        import pprint
         return "AgentHistory(downloads=%s, uploads=%s)" % (
             pprint.pformat(self.downloads),
             pprint.pformat(self.uploads))
@@ -38,7 +38,7 @@ class AgentHistory:
 
 class History:
     """History of the whole sim"""
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, trace=None):
         """
         uploads:
                    dict : peer_id -> [[uploads] -- one list per round]
@@ -47,29 +47,77 @@ class History:
                    
         Keep track of the uploads _from_ and downloads _to_ the
         specified peer id.
+
+        trace: optional simtrace.TraceWriter that every round and
+        completion is also written to.
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
         self.peer_ids = peer_ids[:]
+        self.trace = trace
 
         self.round_done = dict()   # peer_id -> round finished
+        # Why the simulation stopped: "done", "max_round" or "stalled".
+        # Set by the simulator; None while it is still running.
+        self.end_reason = None
         self.downloads = dict((pid, []) for pid in peer_ids)
         self.uploads = dict((pid, []) for pid in peer_ids)
 
-    def update(self, dls, ups):
+        # Running totals, kept up to date by update()
+        self.uploaded_blocks = dict((pid, 0) for pid in peer_ids)  # peer_id -> blocks
+        self.round_blocks = []  # round -> blocks transferred in the swarm
+        # Upload bandwidth that was granted but didn't end up as blocks
+        # anyone kept, unrequested uploads included (see
+        # Sim.update_peer_pieces)
+        self.wasted_from = dict((pid, 0) for pid in peer_ids)  # uploader -> blocks
+        self.wasted_to = dict((pid, 0) for pid in peer_ids)    # requester -> blocks
+        self.round_wasted = []  # round -> blocks wasted in the swarm
+
+    def update(self, dls, ups, wasted=()):
         """
         dls: dict : peer_id -> [downloads] -- downloads for this round
         ups: dict : peer_id -> [uploads] -- uploads for this round
+        wasted: [(uploader id, requester id, blocks)] -- bandwidth wasted
+            this round
 
         append these downloads to to the history
         """
+        uploaded = self.uploaded_blocks
+        total = 0
         for pid in self.peer_ids:
             self.downloads[pid].append(dls[pid])
             self.uploads[pid].append(ups[pid])
+            for d in dls[pid]:
+                uploaded[d.from_id] += d.blocks
+                total += d.blocks
+        self.round_blocks.append(total)
+        total = 0
+        for (from_id, to_id, blocks) in wasted:
+            self.wasted_from[from_id] += blocks
+            self.wasted_to[to_id] += blocks
+            total += blocks
+        self.round_wasted.append(total)
+        if self.trace is not None:
+            self.trace.write_round(self.last_round(), dls)
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
         if peer_id not in self.round_done:
             self.round_done[peer_id] = round
+            if self.trace is not None:
+                self.trace.peer_done(peer_id, round)
+
+    def close_trace(self, meta=None):
+        """Finish the trace file, if there is one."""
+        if self.trace is not None:
+            self.trace.close(meta)
+            self.trace = None
+
+    def recent_throughput(self, k):
+        """Mean blocks transferred per round over the last k rounds, or None
+        if fewer than k rounds have been played."""
+        if k <= 0 or len(self.round_blocks) < k:
+            return None
+        return sum(self.round_blocks[-k:]) / float(k)
 
     def peer_history(self, peer_id):
         return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
@@ -83,8 +131,10 @@ class History:
         s = "\nRound %s:\n" % r
         for peer_id in self.peer_ids:
             ds = self.downloads[peer_id][r]
-            stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
-                peer_id, d.blocks, d.piece, d.from_id)
+            stringify = lambda d: "".join(
+                "%s downloaded %d blocks of piece %d from %s\n" % (
+                    peer_id, blocks, piece, d.from_id)
+                for (piece, blocks) in d.parts())
             s += "".join(map(stringify, ds))
         return s
 
@@ -95,6 +145,7 @@ class History:
         return s
 
     def __repr__(self):
+        import pprint
         return """History(
 uploads=%s
 downloads=%s
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+"""
+Buffered logging pipeline.
+
+The simulation thread only puts records on a queue (logging.handlers.QueueHandler).
+A background writer thread formats them and writes them to the output
+stream in batches, flushing at most every flush_interval seconds, so
+terminal and pipe I/O doesn't stall the simulation loop.
+"""
+
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+_STOP = object()
+
+# The installed writer, if any.  See install() / restart().
+_writer = None
+
+
+class BatchWriter:
+    """Drains a queue of log records and writes them to a stream in
+    batches."""
+    def __init__(self, q, stream, fmt, flush_interval):
+        self.queue = q
+        self.stream = stream
+        self.fmt = fmt
+        self.formatter = logging.Formatter(fmt)
+        self.flush_interval = flush_interval
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="log-writer")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Write out everything queued so far and stop the thread."""
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def _write(self, lines):
+        if lines:
+            self.stream.write("\n".join(lines) + "\n")
+            del lines[:]
+        self.stream.flush()
+
+    def _run(self):
+        lines = []
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0, last_flush + self.flush_interval - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(lines)
+                last_flush = time.monotonic()
+                continue
+            if record is _STOP:
+                self._write(lines)
+                return
+            lines.append(self.formatter.format(record))
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._write(lines)
+                last_flush = time.monotonic()
+
+
+def install(level, stream=None, fmt="%(message)s", flush_interval=0.2):
+    """Route the root logger through a queue to a BatchWriter.
+    Returns the writer."""
+    global _writer
+    stream = stream or sys.__stdout__
+    q = queue.SimpleQueue()
+    writer = BatchWriter(q, stream, fmt, flush_interval)
+
+    root_logger = logging.getLogger('')
+    if _writer is not None:
+        root_logger.removeHandler(_writer.handler)
+    writer.handler = logging.handlers.QueueHandler(q)
+    root_logger.setLevel(level)
+    root_logger.addHandler(writer.handler)
+    writer.start()
+    if _writer is None:
+        atexit.register(stop)
+    _writer = writer
+    return writer
+
+
+def settings():
+    """The logging settings to hand to a child process's restart():
+    (root level, format, flush interval, or None without a writer)."""
+    level = logging.getLogger('').level
+    if _writer is None:
+        return (level, "%(message)s", None)
+    return (level, _writer.fmt, _writer.flush_interval)
+
+
+def restart(settings=None):
+    """
+    Set up logging in a child process.  A forked child inherits the
+    parent's handlers but not its writer thread, so a writer with the same
+    settings is started again.  A spawned child starts with no logging
+    configuration at all, so it needs the parent's settings() and gets a
+    writer or a plain stdout handler to match.
+    """
+    if settings is None:
+        if _writer is not None:
+            install(logging.getLogger('').level, _writer.stream,
+                    _writer.fmt, _writer.flush_interval)
+        return
+    (level, fmt, flush_interval) = settings
+    if flush_interval is not None:
+        install(level, sys.__stdout__, fmt, flush_interval)
+        return
+    root_logger = logging.getLogger('')
+    if not root_logger.handlers:
+        handler = logging.StreamHandler(sys.__stdout__)
+        handler.setFormatter(logging.Formatter(fmt))
+        root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+
+
+def stop():
+    """Flush and stop the installed writer, if any."""
+    if _writer is not None:
+        _writer.stop()
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+
+"""
+Memory accounting for sim.py (--mem-report).
+
+A Sim observer that takes a tracemalloc snapshot at the start of every
+iteration and every --mem-every rounds after that.  Each live allocation is
+attributed the way profiling.py attributes time: to an agent class if an
+agent's code is anywhere on the stack that allocated it, otherwise to the
+innermost simulator module (history, messages, ...) or run_sim_once
+helper.  So Downloads show up under the engine step that created them, and
+the lists History keeps them in under history.
+
+At the end of every iteration it prints, to stderr, the live bytes per
+category and how much they grew during the iteration, the traced peak, and
+the process's peak RSS.  With --mem-out, every snapshot is also written as
+tab-separated rows: iteration, round, category, bytes, growth since the
+previous snapshot.
+
+tracemalloc slows the simulation down several times over; this is for
+finding out where memory goes, not for production runs.  Only the main
+process is measured: with --workers the agents live elsewhere.
+"""
+
+import os
+import ast
+import sys
+import tracemalloc
+
+from profiling import Categorizer
+
+
+def peak_rss():
+    """
+    (bytes, since_reset): the peak resident set size of this process.
+    since_reset is True if it only covers the time since the last
+    reset_peak_rss(), which needs Linux; otherwise it's the peak since the
+    process started.  (None, False) if it can't be measured.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024, _rss_reset
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None, False
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return (r if sys.platform == "darwin" else r * 1024), False
+
+_rss_reset = False
+
+def reset_peak_rss():
+    """Start a new peak RSS measurement, where the OS allows it."""
+    global _rss_reset
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        _rss_reset = True
+    except OSError:
+        pass
+
+
+class FunctionIndex:
+    """
+    Finds the function a source line belongs to.  tracemalloc frames only
+    have a file and a line, but the categories for sim.py are named after
+    its functions.
+    """
+    def __init__(self):
+        self.functions = dict()  # filename -> [(first line, last line, name)]
+
+    def _load(self, filename):
+        fs = []
+        try:
+            with open(filename) as f:
+                tree = ast.parse(f.read())
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    fs.append((node.lineno, node.end_lineno, node.name))
+        except (OSError, SyntaxError, ValueError):
+            pass
+        # innermost (latest starting) definitions first
+        fs.sort(reverse=True)
+        self.functions[filename] = fs
+        return fs
+
+    def name(self, filename, lineno):
+        fs = self.functions.get(filename)
+        if fs is None:
+            fs = self._load(filename)
+        for (first, last, name) in fs:
+            if first <= lineno <= last:
+                return name
+        return None
+
+
+class MemoryReport:
+    def __init__(self, agent_classes, every=1, path=None, depth=10, out=None):
+        """
+        agent_classes: dict class name -> class, as in config.agent_classes
+        every: take a snapshot every this many rounds
+        path: file for the per-snapshot rows, or None
+        depth: number of frames tracemalloc keeps per allocation
+        """
+        self.categorizer = Categorizer(agent_classes)
+        self.functions = FunctionIndex()
+        self.every = max(1, every)
+        self.depth = depth
+        self.out = out or sys.stderr
+        self.rows = None
+        if path is not None:
+            self.rows = open(path, "w")
+            self.rows.write("iteration\tround\tcategory\tbytes\tgrowth\n")
+        self.first = None   # category -> bytes at the start of the iteration
+        self.last = None    # category -> bytes at the last snapshot
+        # Whether tracing was started here (and not, say, by
+        # --profile=tracemalloc, which needs it to go on after the run)
+        self.started = False
+        # tracemalloc.Traceback -> category, or None for the allocations of
+        # tracemalloc and of the report itself.  The same tracebacks come
+        # back in every snapshot.
+        self.categories = dict()
+        self.ignore = set([tracemalloc.__file__, os.path.abspath(__file__)])
+        self.sim_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     "sim.py")
+
+    def category(self, traceback):
+        try:
+            return self.categories[traceback]
+        except KeyError:
+            pass
+        stack = []
+        c = None
+        for f in traceback:
+            if f.filename in self.ignore:
+                break
+            # Only the sim.py categories are named after functions.
+            func = None
+            if f.filename == self.sim_file:
+                func = self.functions.name(f.filename, f.lineno)
+            stack.append((f.filename, func))
+        else:
+            c = self.categorizer.category(stack)
+        self.categories[traceback] = c
+        return c
+
+    def measure(self):
+        """dict: category -> bytes currently allocated"""
+        snapshot = tracemalloc.take_snapshot()
+        sizes = dict()
+        for stat in snapshot.statistics("traceback"):
+            c = self.category(stat.traceback)
+            if c is not None:
+                sizes[c] = sizes.get(c, 0) + stat.size
+        return sizes
+
+    def write_rows(self, iteration, round, sizes):
+        if self.rows is None:
+            return
+        for c in sorted(sizes):
+            self.rows.write("%d\t%s\t%s\t%d\t%d\n" % (
+                iteration, round, c, sizes[c], sizes[c] - self.last.get(c, 0)))
+
+    def start_iteration(self, sim):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.depth)
+            self.started = True
+        if self.started:
+            # The peak of someone else's tracing isn't ours to reset
+            tracemalloc.reset_peak()
+        reset_peak_rss()
+        self.last = dict()
+        self.first = self.measure()
+        self.write_rows(sim.iteration, "start", self.first)
+        self.last = self.first
+
+    def end_round(self, sim, round, history, completed):
+        if round % self.every != 0:
+            return
+        sizes = self.measure()
+        self.write_rows(sim.iteration, round, sizes)
+        self.last = sizes
+
+    def end_iteration(self, sim, history):
+        sizes = self.measure()
+        self.write_rows(sim.iteration, "end", sizes)
+        self.last = sizes
+        (current, peak) = tracemalloc.get_traced_memory()
+        (rss, since_reset) = peak_rss()
+
+        out = self.out
+        out.write("Memory after iteration %d (%d rounds): live bytes, growth\n"
+                  % (sim.iteration, history.last_round() + 1))
+        cats = set(sizes) | set(self.first)
+        for c in sorted(cats, key=lambda c: -sizes.get(c, 0)):
+            out.write("%12d %+12d  %s\n" % (sizes.get(c, 0),
+                                            sizes.get(c, 0) - self.first.get(c, 0), c))
+        out.write("Traced: %d bytes now, %d at peak%s\n" % (
+            current, peak, "" if self.started else " (since tracing started)"))
+        if rss is not None:
+            out.write("Peak RSS: %.1f MB%s\n" % (
+                rss / 1048576.0, "" if since_reset else " (since start)"))
+
+    def end_run(self, sim, summary):
+        if self.rows is not None:
+            self.rows.close()
+            self.rows = None
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
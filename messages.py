@@ -1,5 +1,9 @@
 #!/usr/bin/python
 
+from array import array
+from collections.abc import Set
+
+
 class Upload:
     def __init__(self, from_id, to_id, up_bw):
         self.from_id = from_id
@@ -17,10 +21,33 @@ class Request:
         self.piece_id = piece_id
         self.start = start  # the block index
 
+    def parts(self):
+        """[(piece_id, start)] -- the same interface as RangeRequest"""
+        return [(self.piece_id, self.start)]
+
     def __repr__(self):
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id, self.peer_id, self.piece_id, self.start)
 
+class RangeRequest:
+    """
+    Several pieces requested from one peer in a single message.  pieces is a
+    list of (piece_id, start) pairs in priority order; the uploader's
+    bandwidth is applied to them in that order, exactly as if they had been
+    sent as separate Requests.
+    """
+    def __init__(self, requester_id, peer_id, pieces):
+        self.requester_id = requester_id
+        self.peer_id = peer_id   # peer data is requested from
+        self.pieces = pieces
+
+    def parts(self):
+        return self.pieces
+
+    def __repr__(self):
+        return "RangeRequest(requester_id=%s, peer_id=%s, pieces=%s)" % (
+            self.requester_id, self.peer_id, self.pieces)
+
 class Download:
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
@@ -31,21 +58,182 @@ class Download:
         self.piece = piece      # Which piece?
         self.blocks = blocks    # How much did the agent download?
 
+    def parts(self):
+        """[(piece, blocks)] -- the same interface as DownloadBatch"""
+        return [(self.piece, self.blocks)]
+
     def __repr__(self):
         return "Download(from_id=%s, to_id=%s, piece=%d, blocks=%d)" % (
             self.from_id, self.to_id, self.piece, self.blocks)
 
+class DownloadBatch:
+    """
+    Everything one peer downloaded from another in a round, as a single
+    record (see --coalesce-downloads).  blocks is the total over all the
+    pieces, so code that only looks at from_id, to_id and blocks works with
+    both this and Download.
+    """
+    def __init__(self, from_id, to_id):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.pieces = []   # [(piece, blocks)]
+        self.blocks = 0
+
+    def add(self, piece, blocks):
+        self.pieces.append((piece, blocks))
+        self.blocks += blocks
+
+    def parts(self):
+        return self.pieces
+
+    def __repr__(self):
+        return "DownloadBatch(from_id=%s, to_id=%s, pieces=%s)" % (
+            self.from_id, self.to_id, self.pieces)
+
 
 
             
+class AvailableView(Set):
+    """
+    Read-only view of a set of pieces, without copying it.  Supports
+    membership, iteration, len(), the usual set operators and the
+    intersection/union/difference methods, which return new plain sets.
+    """
+    __slots__ = ("_s",)
+
+    def __init__(self, s):
+        self._s = s
+
+    def __contains__(self, x):
+        return x in self._s
+
+    def __iter__(self):
+        return iter(self._s)
+
+    def __len__(self):
+        return len(self._s)
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def intersection(self, *others):
+        return self._s.intersection(*others)
+
+    def union(self, *others):
+        return self._s.union(*others)
+
+    def difference(self, *others):
+        return self._s.difference(*others)
+
+    def __repr__(self):
+        return "AvailableView(%s)" % sorted(self._s)
+
+
+class CompletePieces(Set):
+    """
+    The available pieces of a peer that has all num_pieces of them (a seed,
+    or a peer that has finished).  Stores nothing per piece: membership and
+    len() are O(1), and intersecting with another set only looks at the
+    other set.
+    """
+    __slots__ = ("num_pieces",)
+
+    def __init__(self, num_pieces):
+        self.num_pieces = num_pieces
+
+    def __contains__(self, x):
+        return isinstance(x, int) and 0 <= x < self.num_pieces
+
+    def __iter__(self):
+        return iter(range(self.num_pieces))
+
+    def __len__(self):
+        return self.num_pieces
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def intersection(self, *others):
+        if len(others) == 0:
+            return set(range(self.num_pieces))
+        result = set(x for x in others[0] if x in self)
+        return result.intersection(*others[1:])
+
+    def union(self, *others):
+        return set(range(self.num_pieces)).union(*others)
+
+    def difference(self, *others):
+        return set(range(self.num_pieces)).difference(*others)
+
+    def __repr__(self):
+        return "CompletePieces(%d)" % self.num_pieces
+
+
+def pieces_array(pieces):
+    """The simulator's per-peer blocks-per-piece counts: an array that can
+    be shared with the agent through read_only_view().  Ints, unless some
+    count is fractional (see add_blocks)."""
+    if all(v == int(v) for v in pieces):
+        return array("i", [int(v) for v in pieces])
+    return array("d", pieces)
+
+
+def add_blocks(a, piece, blocks):
+    """
+    Add blocks to a pieces_array's count for piece.  Nothing stops an agent
+    from uploading a fractional bandwidth, and the counts have always
+    followed it, so the first time a count becomes fractional the array is
+    copied to doubles.  Integral counts stay ints.  Returns the array to go
+    on with: a itself, or its copy (and any views of a must be replaced).
+    """
+    v = a[piece] + blocks
+    if a.typecode == "i":
+        if v != int(v):
+            a = array("d", a)
+        else:
+            v = int(v)
+    a[piece] = v
+    return a
+
+
+def read_only_view(a):
+    """Read-only memoryview of an array: indexable and iterable like a list,
+    reflects later changes to a, and can't be written through."""
+    return memoryview(a).toreadonly()
+
+
 class PeerInfo:
     """
     Only passing peer ids and the pieces they have available to each agent.
-    This prevents them from accidentally messing up the state of other agents.
+    This prevents them from accidentally messing up the state of other agents:
+    available_pieces should be a read-only view such as AvailableView.
+
+    The simulator shares one PeerInfo per peer with every agent for a whole
+    iteration, so it is immutable; when a peer's availability changes the
+    simulator swaps in a new one.
     """
+    __slots__ = ("_id", "_available")
+
     def __init__(self, id, available):
-        self.id = id
-        self.available_pieces = available
+        self._id = id
+        self._available = available
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def available_pieces(self):
+        return self._available
+
+    @property
+    def complete(self):
+        """True if the peer has every piece.  Its available_pieces is then a
+        CompletePieces, which agents can treat as adding the same count to
+        every piece instead of iterating over it."""
+        return isinstance(self.available_pieces, CompletePieces)
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
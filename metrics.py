@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+"""
+Per-round metrics export (sim.py --metrics=PATH).
+
+A Sim observer that writes one row per round with:
+
+  blocks        blocks transferred in the swarm that round
+  wasted        blocks of upload bandwidth wasted that round (see --reclaim)
+  peers_done    peers that have every piece
+  avail_min, avail_max
+                the fewest and the most peers that have any one piece (the
+                spread of piece availability)
+  util_CLASS    for each agent class, blocks its peers uploaded that round
+                over their total upload bandwidth
+
+Formats (--metrics-format):
+  csv    a header line, then one line per round
+  jsonl  one JSON object per round, utilization as a nested object
+  prom   not a time series: the file always holds one Prometheus text
+         exposition of the latest round (plus counters over the run),
+         for a textfile collector to scrape.  It is replaced at most
+         every PROM_INTERVAL seconds and after the last round.  The only
+         label is the agent class.
+
+Block counts are written as integers unless an agent uploaded a
+fractional bandwidth.
+
+Everything is updated incrementally from the round's totals and completed
+pieces, so the cost per round is O(peers), not O(peers * pieces).
+"""
+
+import os
+import json
+import time
+
+PROM_INTERVAL = 1.0     # seconds between rewrites of a prom snapshot
+
+# name, type, help of every family in a prom snapshot
+PROM_FAMILIES = [
+    ("bt_iteration", "gauge", "Iteration of the latest round"),
+    ("bt_round", "gauge", "Latest round of the iteration"),
+    ("bt_rounds_total", "counter", "Rounds simulated in the run"),
+    ("bt_blocks_total", "counter", "Blocks transferred in the run"),
+    ("bt_wasted_blocks_total", "counter", "Blocks of upload bandwidth wasted in the run"),
+    ("bt_round_blocks", "gauge", "Blocks transferred in the latest round"),
+    ("bt_round_wasted", "gauge", "Blocks of upload bandwidth wasted in the latest round"),
+    ("bt_peers_done", "gauge", "Peers that have every piece"),
+    ("bt_availability_min", "gauge", "Fewest peers having any one piece"),
+    ("bt_availability_max", "gauge", "Most peers having any one piece"),
+    ("bt_upload_utilization", "gauge", "Blocks uploaded over upload bandwidth in the latest round, per agent class")]
+
+
+def blocks_value(v):
+    """A block count as written: an int if it is integral."""
+    return int(v) if v == int(v) else round(v, 4)
+
+
+class AvailabilityHistogram:
+    """
+    How many peers have each piece, and how many pieces have each such
+    count.  Counts only ever grow, so the minimum and maximum only move up
+    and are kept up to date in amortized constant time.
+    """
+    def __init__(self, num_pieces, num_peers, base=0):
+        """Every piece starts out at `base` peers (the complete ones)."""
+        self.count = [base] * num_pieces       # piece -> peers that have it
+        self.pieces_with = [0] * (num_peers + 1)  # count -> pieces
+        self.pieces_with[base] = num_pieces
+        self.min = base
+        self.max = base
+
+    def add(self, piece):
+        c = self.count[piece]
+        self.count[piece] = c + 1
+        self.pieces_with[c] -= 1
+        self.pieces_with[c + 1] += 1
+        if c + 1 > self.max:
+            self.max = c + 1
+        while self.min < self.max and self.pieces_with[self.min] == 0:
+            self.min += 1
+
+
+class MetricsWriter:
+    FORMATS = ["csv", "jsonl", "prom"]
+
+    def __init__(self, path, fmt, agent_class_names, buffer_size=1 << 16):
+        """agent_class_names: the class of each peer, in peer order"""
+        if fmt not in self.FORMATS:
+            raise ValueError("Unknown metrics format: %s" % fmt)
+        self.fmt = fmt
+        self.path = path
+        self.peer_classes = agent_class_names
+        self.classes = list(dict.fromkeys(agent_class_names))
+        if fmt == "prom":
+            self.f = None
+            self.last = None        # the latest row, not written yet
+            self.written = None     # time of the last snapshot
+            self.totals = [0, 0, 0]     # rounds, blocks, wasted
+        else:
+            self.f = open(path, "w", buffering=buffer_size)
+            self.write_header()
+
+    def write_header(self):
+        if self.fmt == "csv":
+            cols = ["iteration", "round", "blocks", "wasted", "peers_done",
+                    "avail_min", "avail_max"]
+            cols.extend("util_" + c for c in self.classes)
+            self.f.write(",".join(cols) + "\n")
+
+    # Observer interface
+
+    def start_rounds(self, sim, history, available):
+        ids = history.peer_ids
+        num_pieces = sim.config.num_pieces
+        # Complete peers count for every piece, without going through them
+        partial = [a for a in available if len(a) < num_pieces]
+        self.avail = AvailabilityHistogram(num_pieces, len(ids),
+                                           len(available) - len(partial))
+        for a in partial:
+            for piece in a:
+                self.avail.add(piece)
+        # per-peer upload totals at the end of the last round
+        self.uploaded = [history.uploaded_blocks[pid] for pid in ids]
+        self.capacity = dict((c, 0) for c in self.classes)
+        for (pid, c) in zip(ids, self.peer_classes):
+            self.capacity[c] += history.upload_rates[pid]
+
+    def end_round(self, sim, round, history, completed):
+        for (pid, piece) in completed:
+            self.avail.add(piece)
+        up = dict((c, 0) for c in self.classes)
+        totals = history.uploaded_blocks
+        for (i, pid) in enumerate(history.peer_ids):
+            t = totals[pid]
+            up[self.peer_classes[i]] += t - self.uploaded[i]
+            self.uploaded[i] = t
+        util = dict((c, up[c] / float(self.capacity[c]) if self.capacity[c] else 0.0)
+                    for c in self.classes)
+        self.write_row(sim.iteration, round, history.round_blocks[-1],
+                       history.round_wasted[-1], len(history.round_done), util)
+
+    def end_run(self, sim, summary):
+        self.close()
+
+    def write_row(self, iteration, round, blocks, wasted, done, util):
+        a = self.avail
+        blocks = blocks_value(blocks)
+        wasted = blocks_value(wasted)
+        if self.fmt == "prom":
+            self.totals[0] += 1
+            self.totals[1] += blocks
+            self.totals[2] += wasted
+            self.last = (iteration, round, blocks, wasted, done, a.min, a.max, util)
+            now = time.monotonic()
+            if self.written is None or now - self.written >= PROM_INTERVAL:
+                self.write_snapshot()
+                self.written = now
+        elif self.fmt == "csv":
+            vals = [iteration, round, blocks, wasted, done, a.min, a.max]
+            vals.extend("%.4f" % util[c] for c in self.classes)
+            self.f.write(",".join(map(str, vals)) + "\n")
+        elif self.fmt == "jsonl":
+            self.f.write(json.dumps(dict(
+                iteration=iteration, round=round, blocks=blocks,
+                wasted=wasted, peers_done=done, avail_min=a.min, avail_max=a.max,
+                utilization=util)) + "\n")
+
+    def write_snapshot(self):
+        """Replace the prom file with the latest row, each family's samples
+        together under its HELP and TYPE lines."""
+        if self.last is None:
+            return
+        (iteration, round, blocks, wasted, done, amin, amax, util) = self.last
+        (rounds, total_blocks, total_wasted) = self.totals
+        values = [iteration, round, rounds, blocks_value(total_blocks),
+                  blocks_value(total_wasted), blocks, wasted, done, amin, amax]
+        out = []
+        for ((name, kind, help), v) in zip(PROM_FAMILIES, values + [util]):
+            out.append("# HELP %s %s" % (name, help))
+            out.append("# TYPE %s %s" % (name, kind))
+            if v is util:
+                out.extend('%s{class="%s"} %.4f' % (name, c, util[c])
+                           for c in self.classes)
+            else:
+                out.append("%s %s" % (name, v))
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(out) + "\n")
+        # Readers never see a half-written file
+        os.replace(tmp, self.path)
+        self.last = None
+
+    def close(self):
+        if self.fmt == "prom":
+            self.write_snapshot()
+        elif self.f is not None:
+            self.f.close()
+            self.f = None
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+"""
+Evaluates the decision phase of a round (every peer's requests() and then
+uploads()) in a pool of worker processes.
+
+Each worker owns a fixed subset of the peers.  The agent objects are
+constructed inside the worker and stay there for the whole simulation; the
+simulator only ships per-round deltas:
+  - the pieces that became available anywhere in the swarm last round,
+  - the downloads and uploads of last round for the peers the worker owns,
+  - the neighbor lists of the peers the worker owns, when they change.
+From those the worker keeps its own copy of piece availability, of its
+peers' block counts and of their histories.
+
+Every peer gets its own random stream, seeded by the simulator.  The global
+random state is swapped in before each call into the agent and saved after,
+so the results only depend on the seeds, not on how peers are spread over
+the workers.
+"""
+
+import random
+import multiprocessing
+
+import logqueue
+
+from messages import PeerInfo, AvailableView, CompletePieces
+from messages import pieces_array, add_blocks, read_only_view
+from history import AgentHistory
+
+
+class _PeerState:
+    def __init__(self, agent, pieces, seed):
+        self.agent = agent
+        self.pieces = pieces_array(pieces)
+        self.pieces_view = read_only_view(self.pieces)
+        random.seed(seed)
+        self.rng_state = random.getstate()
+        self.downloads = []
+        self.uploads = []
+        self.neighbors = []
+
+    def call(self, f, *args):
+        """Run f with this peer's random stream swapped in."""
+        random.setstate(self.rng_state)
+        try:
+            return f(*args)
+        finally:
+            self.rng_state = random.getstate()
+
+
+def _worker(conn, log_settings):
+    """Worker loop.  Messages are tuples whose first element is a command."""
+    logqueue.restart(log_settings)
+    peer_ids = []   # all peers in the sim, in simulator order
+    available = dict()  # peer_id -> set of available pieces
+    own = dict()    # peer_id -> _PeerState, only for the peers owned here
+    own_order = []  # owned peer ids, in simulator order
+
+    while True:
+        msg = conn.recv()
+        cmd = msg[0]
+        if cmd == "init":
+            # With reuse, agents the worker already owns are reset()
+            # instead of being constructed again.
+            (_, conf, peer_ids, initial_available, specs, reuse) = msg
+            available = dict((pid, set(a)) for (pid, a)
+                             in zip(peer_ids, initial_available))
+            peer_info = dict((pid, PeerInfo(pid, AvailableView(available[pid])))
+                             for pid in peer_ids)
+            def mark_complete(pid):
+                available[pid] = CompletePieces(conf.num_pieces)
+                peer_info[pid] = PeerInfo(pid, available[pid])
+            for pid in peer_ids:
+                if len(available[pid]) == conf.num_pieces:
+                    mark_complete(pid)
+            old = own
+            own = dict()
+            own_order = []
+            for (class_name, pid, pieces, up_bw, seed) in specs:
+                agent_class = conf.agent_classes[class_name]
+                state = _PeerState(None, pieces, seed)
+                # post_init() and reset() may use randomness too
+                if reuse and pid in old:
+                    state.agent = old[pid].agent
+                    state.call(state.agent.reset, pieces, up_bw)
+                else:
+                    state.agent = state.call(agent_class, conf, pid, pieces, up_bw)
+                own[pid] = state
+                own_order.append(pid)
+            conn.send(None)
+        elif cmd == "requests":
+            (_, completed, downloads, uploads, neighbors) = msg
+            for (pid, piece) in completed:
+                available[pid].add(piece)
+                if len(available[pid]) == conf.num_pieces:
+                    mark_complete(pid)
+            for (pid, ns) in neighbors.items():
+                own[pid].neighbors = ns
+            for pid in own_order:
+                s = own[pid]
+                if pid in downloads:
+                    s.downloads.append(downloads[pid])
+                    s.uploads.append(uploads[pid])
+                    for d in downloads[pid]:
+                        for (piece, blocks) in d.parts():
+                            a = add_blocks(s.pieces, piece, blocks)
+                            if a is not s.pieces:
+                                s.pieces = a
+                                s.pieces_view = read_only_view(a)
+                s.agent.update_pieces(s.pieces_view)
+            result = dict()
+            for pid in own_order:
+                s = own[pid]
+                others = [peer_info[n] for n in s.neighbors]
+                h = AgentHistory(pid, s.downloads, s.uploads)
+                result[pid] = s.call(s.agent.requests, others, h)
+            conn.send(result)
+        elif cmd == "uploads":
+            (_, requests_to) = msg
+            result = dict()
+            for pid in own_order:
+                s = own[pid]
+                others = [peer_info[n] for n in s.neighbors]
+                h = AgentHistory(pid, s.downloads, s.uploads)
+                result[pid] = s.call(s.agent.uploads, requests_to[pid], others, h)
+            conn.send(result)
+        elif cmd == "stop":
+            conn.close()
+            logqueue.stop()
+            return
+        else:
+            raise ValueError("Unknown command: %s" % cmd)
+
+
+class DecisionPool:
+    """
+    A pool of worker processes holding the agents of one simulation.
+    Peer i is owned by worker i % workers.  reset() starts another
+    simulation with the same peers, reusing the processes and the agents.
+    """
+    def __init__(self, conf, peer_ids, pieces, up_bws, seeds, available, workers):
+        self.conf = conf
+        self.peer_ids = peer_ids
+        n = max(1, min(workers, len(peer_ids)))
+        self.conns = []
+        self.procs = []
+        self.owner = dict()  # peer_id -> index of the owning worker
+        for (i, pid) in enumerate(peer_ids):
+            self.owner[pid] = i % n
+
+        for i in range(n):
+            parent, child = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=_worker, daemon=True,
+                                        args=(child, logqueue.settings()))
+            p.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(p)
+        self._init(pieces, up_bws, seeds, available, False)
+
+    def _init(self, pieces, up_bws, seeds, available, reuse):
+        conf = self.conf
+        specs = [[] for c in self.conns]
+        for (i, pid) in enumerate(self.peer_ids):
+            specs[self.owner[pid]].append((conf.agent_class_names[i], pid,
+                                           pieces[i], up_bws[i], seeds[i]))
+        initial_available = [available[pid] for pid in self.peer_ids]
+        for (conn, spec) in zip(self.conns, specs):
+            conn.send(("init", conf, self.peer_ids, initial_available, spec,
+                       reuse))
+        for conn in self.conns:
+            conn.recv()
+
+    def reset(self, pieces, up_bws, seeds, available):
+        """Start over with new initial state (the same arguments as the
+        constructor), calling reset() on the agents the workers hold."""
+        self._init(pieces, up_bws, seeds, available, True)
+
+    def _gather(self, msgs):
+        """Send one message to every worker, return the merged replies,
+        keyed by peer_id in simulator order."""
+        for (conn, msg) in zip(self.conns, msgs):
+            conn.send(msg)
+        merged = dict()
+        for conn in self.conns:
+            merged.update(conn.recv())
+        return dict((pid, merged[pid]) for pid in self.peer_ids)
+
+    def requests(self, completed, downloads, uploads, neighbors=None):
+        """
+        completed: list of (peer_id, piece) that became available last round
+        downloads, uploads: dict peer_id -> list, last round's history,
+            or empty dicts in the first round.
+        neighbors: dict peer_id -> list of neighbor ids, if the topology
+            changed this round, otherwise None.
+
+        Returns dict peer_id -> list of Requests.
+        """
+        msgs = []
+        for i in range(len(self.conns)):
+            mine = [pid for pid in downloads if self.owner[pid] == i]
+            ns = dict()
+            if neighbors is not None:
+                ns = dict((pid, ns) for (pid, ns) in neighbors.items()
+                          if self.owner[pid] == i)
+            msgs.append(("requests", completed,
+                         dict((pid, downloads[pid]) for pid in mine),
+                         dict((pid, uploads[pid]) for pid in mine), ns))
+        return self._gather(msgs)
+
+    def uploads(self, requests):
+        """
+        requests: dict peer_id -> list of Requests made by that peer.
+        Returns dict peer_id -> list of Uploads.
+        """
+        requests_to = [dict() for c in self.conns]
+        for pid in self.peer_ids:
+            requests_to[self.owner[pid]][pid] = []
+        for rs in requests.values():
+            for r in rs:
+                if r.peer_id in self.owner:
+                    requests_to[self.owner[r.peer_id]][r.peer_id].append(r)
+        return self._gather([("uploads", rt) for rt in requests_to])
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("stop",))
+                conn.close()
+            except (OSError, EOFError):
+                pass
+        for p in self.procs:
+            # A worker stuck sending a reply nobody reads won't see "stop"
+            p.join(5)
+            if p.is_alive():
+                p.terminate()
+                p.join()
@@ -22,12 +22,28 @@ class Peer:
     def __repr__(self):
         return "%s(id=%s pieces=%s up_bw=%d)" % (
             self.__class__.__name__,
-            self.id, self.pieces, self.up_bw)
+            self.id, list(self.pieces), self.up_bw)
+
+    def reset(self, init_pieces, up_bandwidth):
+        """
+        Called by the sim (with --reuse-peers) instead of constructing a new
+        peer at the start of every iteration after the first.  Must leave
+        the peer as if it had just been constructed with these arguments.
+
+        By default this redoes what __init__ does, post_init() included;
+        override it if your agent can start over more cheaply.
+        """
+        self.pieces = init_pieces[:]
+        self.up_bw = round(up_bandwidth)
+        self.post_init()
 
     def update_pieces(self, new_pieces):
         """
         Called by the sim when this peer gets new pieces.  Using a function
         so it's easy to add any extra processing...
+
+        new_pieces is a read-only view of the sim's own counts, so it stays
+        up to date; copy it (list(new_pieces)) to keep a snapshot.
         """
         self.pieces = new_pieces
 
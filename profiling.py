@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+"""
+Profiling modes for sim.py (--profile).
+
+  cprofile     deterministic profile of every call (cProfile)
+  sampling     a background thread samples the simulation thread's stack
+               every --profile-interval seconds; low overhead
+  tracemalloc  where the memory still allocated at the end was allocated
+
+Every mode writes PREFIX.collapsed: one "frame;frame;...;frame count" line
+per distinct stack, the input format of flamegraph.pl and speedscope.  The
+counts are microseconds (cprofile), samples (sampling) or bytes
+(tracemalloc).  cprofile also writes the raw stats to PREFIX.prof.
+
+It then prints a top-N table to stderr, with the cost attributed to either
+an agent class (anything under an agent's methods, including library code
+they call) or an engine phase (the innermost simulator module, such as
+history, or for sim.py the run_sim_once helper such as check_requests that
+run_sim_once called, with whatever that helper calls in sim.py), followed
+by the top-N functions.
+
+Only the main process is profiled: with --workers the agents run elsewhere.
+"""
+
+import os
+import sys
+import inspect
+import threading
+
+# Simulator modules, whose time counts as an engine phase.
+ENGINE_FILES = ["sim.py", "history.py", "stats.py", "messages.py",
+                "topology.py", "simtrace.py", "parallel.py", "logqueue.py",
+                "util.py"]
+
+
+class Categorizer:
+    """Names the agent class or engine phase that a stack belongs to."""
+    def __init__(self, agent_classes):
+        """agent_classes: dict class name -> class, as in config.agent_classes"""
+        self.agent_files = dict()   # path -> "agent Class[/Class...]"
+        for (name, cls) in sorted(agent_classes.items()):
+            try:
+                path = os.path.abspath(inspect.getfile(cls))
+            except TypeError:
+                continue
+            if path in self.agent_files:
+                self.agent_files[path] += "/" + name
+            else:
+                self.agent_files[path] = "agent " + name
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.engine_files = dict((os.path.join(here, f), f[:-3])
+                                 for f in ENGINE_FILES)
+
+    def category(self, stack):
+        """stack: [(filename, function name)], outermost first."""
+        stack = [(os.path.abspath(filename), func) for (filename, func) in stack]
+        for (filename, func) in stack:
+            c = self.agent_files.get(filename)
+            if c is not None:
+                return c
+        for (filename, func) in reversed(stack):
+            module = self.engine_files.get(filename)
+            if module == "sim" and func is not None:
+                sim_frames = [short_name(func) for (f, func) in stack
+                              if f == filename and func is not None]
+                name = sim_phase(sim_frames)
+                if name is not None:
+                    return "engine " + name
+            elif module is not None:
+                return "engine " + module
+        return "other"
+
+
+def short_name(func):
+    """"Sim.run_sim_once.<locals>.check_requests" -> "check_requests".
+    cProfile only has the last part to begin with."""
+    return func.rsplit(".", 1)[-1]
+
+
+def sim_phase(names):
+    """
+    The engine phase for the sim.py functions on a stack, outermost first:
+    the run_sim_once helper that run_sim_once called, so the helpers,
+    predicates, lambdas and comprehensions under it belong to it, or
+    otherwise the innermost named function (a Sim method such as up_bw, or
+    run_sim_once itself).  None if there are only lambdas and the like.
+    """
+    named = [n for n in names if not n.startswith("<")]
+    if "run_sim_once" in named:
+        below = named[named.index("run_sim_once") + 1:]
+        return below[0] if below else "run_sim_once"
+    return named[-1] if named else None
+
+
+def frame_name(filename, lineno, func):
+    """func is None for tracemalloc frames, which only have a line."""
+    if func is None:
+        return "%s:%d" % (os.path.basename(filename), lineno)
+    return "%s:%s:%d" % (func, os.path.basename(filename), lineno)
+
+
+def write_collapsed(path, stacks):
+    """stacks: dict tuple of frame names -> count"""
+    with open(path, "w") as f:
+        for (stack, count) in sorted(stacks.items()):
+            if count > 0:
+                f.write("%s %d\n" % (";".join(stack), count))
+
+
+def print_table(title, unit, rows, top, out):
+    """rows: dict name -> cost"""
+    total = float(sum(rows.values())) or 1.0
+    out.write("%s (%s)\n" % (title, unit))
+    for (name, cost) in sorted(rows.items(), key=lambda kv: -kv[1])[:top]:
+        out.write("%12.0f %5.1f%%  %s\n" % (cost, 100 * cost / total, name))
+
+
+def report(stacks, categorizer, unit, prefix, top, out=None):
+    """Write PREFIX.collapsed and print the tables.
+
+    stacks: dict tuple of (filename, lineno, func), outermost first -> cost
+    """
+    out = out or sys.stderr
+    collapsed = dict()
+    by_category = dict()
+    by_function = dict()
+    for (stack, cost) in stacks.items():
+        names = tuple(frame_name(*f) for f in stack)
+        collapsed[names] = collapsed.get(names, 0) + cost
+        c = categorizer.category([(f, func) for (f, l, func) in stack])
+        by_category[c] = by_category.get(c, 0) + cost
+        if stack:
+            leaf = names[-1]
+            by_function[leaf] = by_function.get(leaf, 0) + cost
+    write_collapsed(prefix + ".collapsed", collapsed)
+    print_table("By agent class / engine phase", unit, by_category, top, out)
+    print_table("Top functions (self)", unit, by_function, top, out)
+    out.write("Collapsed stacks written to %s.collapsed\n" % prefix)
+
+
+def cprofile_stacks(stats, max_depth=100, min_time=1e-6, max_paths=200000):
+    """
+    Rebuild approximate stacks from cProfile's caller/callee edges:
+    starting from the roots, each function's cumulative time is split among
+    the paths that reach it in proportion to the time of each call edge.
+    Paths worth less than min_time seconds are dropped.  Call graphs with
+    many routes to the same functions have exponentially many paths, so
+    after max_paths of them, and below max_depth frames, a path isn't
+    followed further: all of its time counts as the last frame's.
+    Returns dict stack -> microseconds of self time.
+    """
+    callees = dict()
+    for (func, (cc, nc, tt, ct, callers)) in stats.items():
+        for (caller, edge) in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for (func, s) in stats.items() if not s[4]]
+
+    stacks = dict()
+    paths = [0]
+    def walk(func, time, path, on_path):
+        (cc, nc, tt, ct, callers) = stats[func]
+        if ct <= 0 or time < min_time:
+            return
+        scale = min(1.0, time / ct)
+        path = path + (func,)
+        paths[0] += 1
+        if len(path) >= max_depth or paths[0] >= max_paths:
+            stacks[path] = stacks.get(path, 0) + int(time * 1e6)
+            return
+        us = int(tt * scale * 1e6)
+        if us > 0:
+            stacks[path] = stacks.get(path, 0) + us
+        for (callee, edge_ct) in callees.get(func, []):
+            if callee not in on_path:
+                on_path.add(callee)
+                walk(callee, edge_ct * scale, path, on_path)
+                on_path.discard(callee)
+    for root in roots:
+        walk(root, stats[root][3], (), set([root]))
+    return stacks
+
+
+def run_cprofile(f, categorizer, prefix, top):
+    import cProfile
+    import pstats
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(f)
+    finally:
+        prof.dump_stats(prefix + ".prof")
+        stats = pstats.Stats(prof).stats
+        report(cprofile_stacks(stats), categorizer, "us", prefix, top)
+
+
+class Sampler:
+    """Samples one thread's stack from a background thread."""
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = dict()    # stack -> samples
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="profile-sampler")
+
+    def _run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                              getattr(code, "co_qualname", code.co_name)))
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+
+
+def run_sampling(f, categorizer, prefix, top, interval):
+    sampler = Sampler(threading.get_ident(), interval)
+    sampler.start()
+    try:
+        return f()
+    finally:
+        sampler.stop()
+        report(sampler.stacks, categorizer, "samples", prefix, top)
+
+
+def run_tracemalloc(f, categorizer, prefix, top, depth=25):
+    import tracemalloc
+    tracemalloc.start(depth)
+    try:
+        return f()
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stacks = dict()
+        for stat in snapshot.statistics("traceback"):
+            stack = tuple((fr.filename, fr.lineno, None) for fr in stat.traceback)
+            stacks[stack] = stacks.get(stack, 0) + stat.size
+        report(stacks, categorizer, "bytes", prefix, top)
+        sys.stderr.write("Traced memory: %d bytes now, %d bytes at peak\n" %
+                         (current, peak))
+
+
+def run(mode, f, agent_classes, prefix="profile", top=20, interval=0.005):
+    """Call f() under the given profiling mode, report, and return its
+    result.  mode is one of 'none', 'cprofile', 'sampling' or 'tracemalloc'."""
+    if mode == "none":
+        return f()
+    categorizer = Categorizer(agent_classes)
+    if mode == "cprofile":
+        return run_cprofile(f, categorizer, prefix, top)
+    elif mode == "sampling":
+        return run_sampling(f, categorizer, prefix, top, interval)
+    elif mode == "tracemalloc":
+        return run_tracemalloc(f, categorizer, prefix, top)
+    raise ValueError("Unknown profiling mode: %s" % mode)
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+"""
+Live progress for long runs (sim.py --progress).
+
+A Sim observer that keeps a few counters up to date every round and, at
+most once per interval, writes a status line to stderr:
+
+  iter 3/100  round 57  812.4 rounds/s  30120 blocks/s  done 41/50  ETA 0:02:31
+
+Rounds and blocks per second are averaged over the whole run so far.  The
+ETA assumes the remaining iterations take as many rounds as the finished
+ones did on average (max_round + 1 before any has finished).  On a
+terminal the line is rewritten in place.
+"""
+
+import sys
+import time
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressReporter:
+    def __init__(self, interval=0.5, out=None):
+        self.interval = interval
+        self.out = out or sys.stderr
+        self.tty = hasattr(self.out, "isatty") and self.out.isatty()
+        self.start = None
+        self.last_report = 0
+        self.rounds = 0         # over all iterations
+        self.blocks = 0
+        self.finished_iters = 0
+        self.finished_rounds = 0  # rounds of the finished iterations
+        self.width = 0
+
+    def start_iteration(self, sim):
+        if self.start is None:
+            self.start = time.monotonic()
+            self.last_report = self.start
+
+    def end_round(self, sim, round, history, completed):
+        self.rounds += 1
+        self.blocks += history.round_blocks[-1]
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(sim, round, history, now)
+
+    def end_iteration(self, sim, history):
+        self.finished_iters += 1
+        self.finished_rounds += history.last_round() + 1
+
+    def end_run(self, sim, summary):
+        if self.tty and self.width > 0:
+            self.out.write("\n")
+            self.out.flush()
+
+    def eta(self, sim, round, elapsed):
+        """Seconds left, or None before there is a rate to go by."""
+        conf = sim.config
+        if self.rounds == 0 or elapsed <= 0:
+            return None
+        if self.finished_iters > 0:
+            per_iter = self.finished_rounds / float(self.finished_iters)
+        else:
+            per_iter = conf.max_round + 1
+        left = max(0, per_iter - (round + 1))
+        left += per_iter * (conf.iters - sim.iteration - 1)
+        return left / (self.rounds / elapsed)
+
+    def report(self, sim, round, history, now):
+        conf = sim.config
+        elapsed = now - self.start
+        line = "iter %d/%d  round %d  %.1f rounds/s  %.0f blocks/s  done %d/%d  ETA %s" % (
+            sim.iteration + 1, conf.iters, round,
+            self.rounds / elapsed, self.blocks / elapsed,
+            len(history.round_done), len(history.peer_ids),
+            format_duration(self.eta(sim, round, elapsed)))
+        if self.tty:
+            pad = max(0, self.width - len(line))
+            self.width = len(line)
+            self.out.write("\r" + line + " " * pad)
+        else:
+            self.out.write(line + "\n")
+        self.out.flush()
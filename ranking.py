@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+"""
+Incremental ranking structures for agents that unchoke by score (BitTyrant
+and friends), so choosing whom to upload to doesn't mean re-sorting every
+requester and rescanning the history each round.
+
+  ScoreHeap             max-heap of keys by score, with updates and
+                        removals by key in O(log n)
+  ReciprocationTracker  for each peer, how many rounds in a row it has
+                        uploaded to us, kept up to date from each new
+                        round's downloads
+  RequesterRanking      a round's requesters in decreasing order of score,
+                        in the same order sorted(..., reverse=True) gives
+"""
+
+import heapq
+
+
+class ScoreHeap:
+    """Keys ordered by decreasing score.  Keys with equal scores come out in
+    no particular order."""
+    def __init__(self):
+        self.heap = []      # [(score, key)], highest score first
+        self.pos = dict()   # key -> index in self.heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.pos
+
+    def keys(self):
+        return list(self.pos)
+
+    def score(self, key):
+        return self.heap[self.pos[key]][0]
+
+    def set(self, key, score):
+        """Add key, or change its score."""
+        i = self.pos.get(key)
+        if i is None:
+            self.heap.append((score, key))
+            self.pos[key] = len(self.heap) - 1
+            self._up(len(self.heap) - 1)
+        else:
+            old = self.heap[i][0]
+            self.heap[i] = (score, key)
+            if score > old:
+                self._up(i)
+            elif score < old:
+                self._down(i)
+
+    def remove(self, key):
+        i = self.pos.pop(key)
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.pos[last[1]] = i
+            self._up(i)
+            self._down(self.pos[last[1]])
+
+    def top(self):
+        """(key, score) with the highest score"""
+        (score, key) = self.heap[0]
+        return (key, score)
+
+    def iter_top(self):
+        """
+        Yield (key, score) in decreasing order of score without changing
+        the heap.  Getting the first k costs O(k log k).  The heap must not
+        be changed while iterating.
+        """
+        heap = self.heap
+        if not heap:
+            return
+        frontier = [(-heap[0][0], 0)]
+        while frontier:
+            (neg, i) = heapq.heappop(frontier)
+            yield (heap[i][1], heap[i][0])
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < len(heap):
+                    heapq.heappush(frontier, (-heap[c][0], c))
+
+    def _swap(self, i, j):
+        h = self.heap
+        (h[i], h[j]) = (h[j], h[i])
+        self.pos[h[i][1]] = i
+        self.pos[h[j][1]] = j
+
+    def _up(self, i):
+        h = self.heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if h[i][0] <= h[parent][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _down(self, i):
+        h = self.heap
+        n = len(h)
+        while True:
+            best = i
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < n and h[c][0] > h[best][0]:
+                    best = c
+            if best == i:
+                break
+            self._swap(i, best)
+            i = best
+
+
+class ReciprocationTracker:
+    """
+    For each peer, the number of consecutive rounds, up to the last round
+    seen, in which it uploaded to us.  update() only looks at rounds it
+    hasn't seen yet, so each round's downloads are read once.
+    """
+    def __init__(self):
+        self.rounds = 0         # rounds seen
+        self.last = dict()      # peer_id -> last round it uploaded to us
+        self.run = dict()       # peer_id -> rounds in a row up to then
+
+    def update(self, downloads):
+        """downloads: list round -> [Download] for all rounds so far, as in
+        AgentHistory.downloads"""
+        for r in range(self.rounds, len(downloads)):
+            for dl in downloads[r]:
+                p = dl.from_id
+                last = self.last.get(p)
+                if last == r:
+                    continue
+                self.run[p] = self.run[p] + 1 if last == r - 1 else 1
+                self.last[p] = r
+        self.rounds = max(self.rounds, len(downloads))
+
+    def streak(self, peer_id):
+        """Rounds in a row, ending with the last round seen, in which
+        peer_id uploaded to us (0 if it didn't in the last round)."""
+        if self.last.get(peer_id) != self.rounds - 1:
+            return 0
+        return self.run[peer_id]
+
+
+class RequesterRanking:
+    """
+    Requesters in decreasing order of score.  The ScoreHeap is kept
+    between rounds: only the requesters that come or go and the peers whose
+    score changed (rescore()) cost anything, and taking the first k is
+    O(k log n).
+    """
+    def __init__(self, score):
+        """score: function peer_id -> score"""
+        self.score = score
+        self.heap = ScoreHeap()
+
+    def rescore(self, peer_ids):
+        """The scores of these peers may have changed."""
+        for p in peer_ids:
+            if p in self.heap:
+                self.heap.set(p, self.score(p))
+
+    def ranked(self, requesting_peers):
+        """
+        Yield requesting_peers (which may repeat a peer) in the order
+        sorted(requesting_peers, key=self.score, reverse=True) would: by
+        decreasing score, equal scores in their original order.  Meant to
+        be stopped early.
+        """
+        positions = dict()  # peer_id -> indices in requesting_peers
+        for (i, p) in enumerate(requesting_peers):
+            positions.setdefault(p, []).append(i)
+        for p in self.heap.keys():
+            if p not in positions:
+                self.heap.remove(p)
+        for p in positions:
+            if p not in self.heap:
+                self.heap.set(p, self.score(p))
+
+        # Peers with equal scores are merged back into request order
+        group = []
+        group_score = None
+        for (p, score) in self.heap.iter_top():
+            if group and score != group_score:
+                for (i, q) in sorted((i, q) for q in group for i in positions[q]):
+                    yield q
+                group = []
+            group.append(p)
+            group_score = score
+        for (i, q) in sorted((i, q) for q in group for i in positions[q]):
+            yield q
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+
+"""
+Results database (sim.py --db=PATH): every iteration's results go into a
+SQLite database, so thousands of runs can be compared with a query instead
+of by scraping logs.
+
+  runs        one row per sim.py run: the config (as canonical JSON, and
+              its hash), the agent mix, the seed and the config values
+              that are most often grouped by
+  iterations  rounds, end reason and wall-clock runtime of each iteration
+  peers       each peer's agent class, upload bandwidth, uploaded blocks
+              and completion round (NULL if it didn't finish)
+  classes     the same per agent class: the class's mean over its peers in
+              the iteration
+  class_totals
+              running sums of classes per run and agent class, so that
+              comparing classes reads one row per run instead of one per
+              iteration
+
+Rows are written in batches, one transaction per --db-batch iterations.
+Indexes on the config hash and bandwidth range of runs and on the agent
+class of peers and classes keep queries selective, and class_totals keeps
+the class comparisons at milliseconds however many iterations there are.
+
+Canned queries:
+
+  python resultstore.py results.db classes [--by=COL,...] [--where=SQL] [Class ...]
+      mean uploaded blocks and completion round per agent class, grouped
+      by run columns (default min_up_bw,max_up_bw); --where can use r
+      (runs) and c (class_totals)
+  python resultstore.py results.db sql "SELECT ..."
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from optparse import OptionParser
+
+from stats import Stats
+
+# Config values copied into columns of runs, to group and filter by
+RUN_COLUMNS = ["num_pieces", "blocks_per_piece", "min_up_bw", "max_up_bw",
+               "max_round", "iters", "topology", "seed"]
+# Config keys that don't change the results
+IGNORED_KEYS = ["agent_classes", "agent_class_names", "trace_dir", "workers",
+                "reuse_peers", "seed", "crn_seed", "iters"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL,
+    config TEXT,
+    config_hash TEXT,
+    agent_mix TEXT,
+    %s
+);
+CREATE TABLE IF NOT EXISTS iterations (
+    run_id INTEGER,
+    iteration INTEGER,
+    rounds INTEGER,
+    end_reason TEXT,
+    runtime REAL,
+    PRIMARY KEY (run_id, iteration)
+);
+CREATE TABLE IF NOT EXISTS peers (
+    run_id INTEGER,
+    iteration INTEGER,
+    peer_id TEXT,
+    agent_class TEXT,
+    up_bw REAL,
+    uploaded REAL,
+    completion INTEGER
+);
+CREATE TABLE IF NOT EXISTS classes (
+    run_id INTEGER,
+    iteration INTEGER,
+    agent_class TEXT,
+    peers INTEGER,
+    uploaded REAL,
+    completion REAL
+);
+CREATE TABLE IF NOT EXISTS class_totals (
+    run_id INTEGER,
+    agent_class TEXT,
+    iterations INTEGER,
+    uploaded REAL,          -- sum over iterations of the class mean
+    completed INTEGER,      -- iterations in which all its peers finished
+    completion REAL,        -- sum over those of the class mean
+    PRIMARY KEY (agent_class, run_id)
+);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (config_hash);
+CREATE INDEX IF NOT EXISTS runs_bw ON runs (min_up_bw, max_up_bw);
+CREATE INDEX IF NOT EXISTS peers_run ON peers (run_id, iteration);
+CREATE INDEX IF NOT EXISTS peers_class ON peers (agent_class, run_id);
+CREATE INDEX IF NOT EXISTS classes_class
+    ON classes (agent_class, run_id, uploaded, completion);
+""" % ",\n    ".join(RUN_COLUMNS)
+
+
+def config_json(conf):
+    """The config values that affect the results, as canonical JSON."""
+    d = dict((k, v) for (k, v) in vars(conf).items()
+             if not k.startswith("_") and k not in IGNORED_KEYS)
+    return json.dumps(d, sort_keys=True, default=str)
+
+
+def agent_mix(class_names):
+    """["Seed", "Std", "Std"] -> "Seed,1 Std,2", the way sim.py takes it"""
+    counts = dict()
+    for c in class_names:
+        counts[c] = counts.get(c, 0) + 1
+    return " ".join("%s,%d" % kv for kv in sorted(counts.items()))
+
+
+class ResultStore:
+    def __init__(self, path, batch_size=100):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.batch_size = max(1, batch_size)
+        self.rows = dict(iterations=[], peers=[], classes=[])
+        self.buffered = 0   # iterations not written yet
+        self.run_id = None
+        self.start = None
+
+    def add_run(self, conf):
+        """Record a run; returns its id."""
+        cfg = config_json(conf)
+        values = [time.time(), cfg, hashlib.sha1(cfg.encode()).hexdigest(),
+                  agent_mix(conf.agent_class_names)]
+        values.extend(getattr(conf, c, None) for c in RUN_COLUMNS)
+        cur = self.db.execute(
+            "INSERT INTO runs (created, config, config_hash, agent_mix, %s) VALUES (%s)"
+            % (", ".join(RUN_COLUMNS), ", ".join("?" * len(values))), values)
+        self.db.commit()
+        return cur.lastrowid
+
+    def add_iteration(self, run_id, iteration, peer_ids, peer_classes,
+                      history, runtime):
+        """Buffer one iteration's rows; written every batch_size iterations."""
+        uploaded = Stats.uploaded_blocks(peer_ids, history)
+        completion = Stats.completion_rounds(peer_ids, history)
+        self.rows["iterations"].append((run_id, iteration, history.last_round() + 1,
+                                        history.end_reason, runtime))
+        by_class = dict()   # class -> [peers, uploaded, completions or None]
+        for (pid, c) in zip(peer_ids, peer_classes):
+            self.rows["peers"].append((run_id, iteration, pid, c,
+                                       history.upload_rates[pid],
+                                       uploaded[pid], completion[pid]))
+            agg = by_class.setdefault(c, [0, 0, 0])
+            agg[0] += 1
+            agg[1] += uploaded[pid]
+            if agg[2] is not None:
+                agg[2] = None if completion[pid] is None else agg[2] + completion[pid]
+        for (c, (n, up, done)) in by_class.items():
+            self.rows["classes"].append((run_id, iteration, c, n, up / float(n),
+                                         None if done is None else done / float(n)))
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows in one transaction."""
+        totals = dict()     # (run, class) -> [iterations, uploaded, completed, completion]
+        for (run_id, iteration, c, n, up, done) in self.rows["classes"]:
+            t = totals.setdefault((run_id, c), [0, 0, 0, 0])
+            t[0] += 1
+            t[1] += up
+            if done is not None:
+                t[2] += 1
+                t[3] += done
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO class_totals VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (agent_class, run_id) DO UPDATE SET "
+                "iterations = iterations + excluded.iterations, "
+                "uploaded = uploaded + excluded.uploaded, "
+                "completed = completed + excluded.completed, "
+                "completion = completion + excluded.completion",
+                [k + tuple(t) for (k, t) in totals.items()])
+            for (table, rows) in self.rows.items():
+                if rows:
+                    self.db.executemany("INSERT INTO %s VALUES (%s)" % (
+                        table, ", ".join("?" * len(rows[0]))), rows)
+                    del rows[:]
+        self.buffered = 0
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    # Sim observer interface
+
+    def start_iteration(self, sim):
+        if self.run_id is None:
+            self.run_id = self.add_run(sim.config)
+        self.start = time.perf_counter()
+
+    def end_iteration(self, sim, history):
+        self.add_iteration(self.run_id, sim.iteration, sim.peer_ids,
+                           sim.config.agent_class_names, history,
+                           time.perf_counter() - self.start)
+
+    def end_run(self, sim, summary):
+        self.close()
+
+
+def class_means(db, classes=None, by=("min_up_bw", "max_up_bw"), where=None):
+    """
+    Mean uploaded blocks and completion round of each agent class, grouped
+    by the given runs columns.  Completion is over the iterations in which
+    all of the class's peers finished.
+    Returns (column names, rows).
+    """
+    for col in by:
+        if col not in RUN_COLUMNS + ["agent_mix", "config_hash"]:
+            raise ValueError("Can't group by %s" % col)
+    group = ["r.%s" % col for col in by] + ["c.agent_class"]
+    sql = ("SELECT %s, SUM(c.iterations), SUM(c.uploaded) / SUM(c.iterations), "
+           "SUM(c.completion) / SUM(c.completed) "
+           "FROM class_totals c JOIN runs r ON r.id = c.run_id" % ", ".join(group))
+    conds = []
+    args = []
+    if classes:
+        conds.append("c.agent_class IN (%s)" % ", ".join("?" * len(classes)))
+        args.extend(classes)
+    if where:
+        conds.append("(%s)" % where)
+    if conds:
+        sql += " WHERE " + " AND ".join(conds)
+    sql += " GROUP BY %s ORDER BY %s" % (", ".join(group), ", ".join(group))
+    names = list(by) + ["agent_class", "iterations", "uploaded", "completion"]
+    return (names, db.execute(sql, args).fetchall())
+
+
+def print_rows(names, rows, out=None):
+    out = out or sys.stdout
+    def fmt(v):
+        if v is None:
+            return "None"
+        return "%.2f" % v if isinstance(v, float) else str(v)
+    table = [names] + [[fmt(v) for v in row] for row in rows]
+    widths = [max(len(r[i]) for r in table) for i in range(len(names))]
+    for r in table:
+        out.write("  ".join(v.rjust(w) for (v, w) in zip(r, widths)) + "\n")
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog DB classes [--by=COL,...] [--where=SQL] [Class ...]\n"
+                          "       %prog DB sql QUERY")
+    parser.add_option("--by", dest="by", default="min_up_bw,max_up_bw",
+                      help="Runs columns to group by, comma-separated")
+    parser.add_option("--where", dest="where", default=None,
+                      help="Extra SQL condition on r (runs) and c (class_totals)")
+    (options, args) = parser.parse_args(args[1:])
+    if len(args) < 2:
+        parser.error("Need a database and a command")
+    db = sqlite3.connect(args[0])
+    start = time.perf_counter()
+    if args[1] == "classes":
+        by = [c for c in options.by.split(",") if c]
+        try:
+            (names, rows) = class_means(db, args[2:], by, options.where)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args[1] == "sql" and len(args) == 3:
+        cur = db.execute(args[2])
+        names = [d[0] for d in cur.description or []]
+        rows = cur.fetchall()
+    else:
+        parser.error("Unknown command: %s" % " ".join(args[1:]))
+    print_rows(names, rows)
+    sys.stderr.write("%d rows in %.1f ms\n" % (
+        len(rows), 1000 * (time.perf_counter() - start)))
+
+if __name__ == "__main__":
+    main(sys.argv)
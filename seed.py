@@ -12,7 +12,8 @@ class Seed(Peer):
 
     def uploads(self, requests, peers, history):
         max_upload = 4  # max num of peers to upload to at a time
-        requester_ids = list(set([r.requester_id for r in requests]))
+        # sorted, so the choice below only depends on the random seed
+        requester_ids = sorted(set([r.requester_id for r in requests]))
 
         n = min(max_upload, len(requester_ids))
         if n == 0:
@@ -7,25 +7,61 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
 """
 
-import re
+import os
 import random
 import sys
 import logging
-import copy
 import itertools
-import pprint
 from optparse import OptionParser
 
-from messages import Upload, Request, Download, PeerInfo
+from messages import Upload, Request, RangeRequest, Download, DownloadBatch
+from messages import PeerInfo, AvailableView
+from messages import CompletePieces
+from messages import pieces_array, add_blocks, read_only_view
 from util import *
-from stats import Stats
+from stats import Stats, RunSummary
 from history import History
+from topology import make_topology
     
 
 class Sim:
     def __init__(self, config):
         self.config = config
         self.up_bws_state = dict()
+        self.iteration = 0  # index of the current run_sim_once
+        # Kept between iterations with config.reuse_peers: the agents (or
+        # the DecisionPool holding them) and each peer's own pieces array
+        # (None for seeds).
+        self.reused_peers = None
+        self.reused_pool = None
+        self.reused_arrays = None
+        self.observers = []  # see add_observer()
+        # Bandwidth stream of the current iteration with config.crn_seed
+        self.bw_rng = None
+
+    def add_observer(self, obs):
+        """
+        Register an object to be told how the simulation is going.  It may
+        define any of these methods:
+          start_iteration(sim)            before the peers are created
+          start_rounds(sim, history, available)
+                                          before the first round
+          end_round(sim, round, history, completed)
+                                          after each round is recorded
+          end_iteration(sim, history)     after the last round
+          end_run(sim, summary)           after run_sim's last iteration
+        sim.iteration is the index of the current iteration.  available is
+        the list of each peer's available pieces (read-only views, in
+        sim.peer_ids order) and completed the (peer_id, piece) pairs that
+        became available in the round.
+        """
+        self.observers.append(obs)
+
+    def notify(self, event, *args):
+        for obs in self.observers:
+            f = getattr(obs, event, None)
+            if f is not None:
+                f(self, *args)
 
     
     def up_bw(self, peer_id, reinit=False):
@@ -37,11 +73,37 @@ class Sim:
         if reinit and peer_id in s:
             del s[peer_id]
         
+        if peer_id in s:
+            return s[peer_id]
+
         """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
+        if self.bw_rng is not None:
+            # Seeds take a draw too, so the n-th peer gets the same
+            # bandwidth whatever the agent mix
+            drawn = self.bw_rng.randint(c.min_up_bw, c.max_up_bw)
+        if peer_id.startswith("Seed"): the_up_bw = c.max_up_bw
+        elif self.bw_rng is not None: the_up_bw = drawn
         else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
         
-        return s.setdefault(peer_id, the_up_bw)
+        s[peer_id] = the_up_bw
+        return the_up_bw
+
+    def start_streams(self):
+        """
+        With config.crn_seed (common random numbers), every iteration's
+        random draws come from that seed and the iteration number alone:
+        the bandwidths from their own stream, one draw per peer in order,
+        and everything else (the engine, the agents, the per-peer seeds
+        of --workers) from the global random state, re-seeded.  So runs
+        with different agent mixes see the same bandwidths and start each
+        iteration from the same state (see compare.py).
+        """
+        conf = self.config
+        if conf.crn_seed is None:
+            return
+        streams = random.Random("%d:%d" % (conf.crn_seed, self.iteration))
+        self.bw_rng = random.Random(streams.getrandbits(64))
+        random.seed(streams.getrandbits(64))
 
     def run_sim_once(self):
         """Return a history"""
@@ -49,6 +111,10 @@ class Sim:
         # Keep track of the current round.  Needs to be in scope for helpers.
         round = 0  
 
+        # Internally peers are dense integer handles: the index of the peer
+        # in ids.  String ids are only used at the agent API (messages,
+        # PeerInfo, AgentHistory) and in the output.
+
         def check_pred(pred, msg, Exc, lst):
             """Check if any element of lst matches the predicate.  If it does,
             raise an exception of type Exc, including the msg and the offending
@@ -58,81 +124,114 @@ class Sim:
                 i = m.index(True)
                 raise Exc(msg + " Bad element: %s" % lst[i])
 
-        def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
+        def check_uploads(h, uploads):
+            """Raise an IllegalUpload exception if there is a problem.
+            Otherwise return dict: handle -> bw for the uploads to actual
+            peers (the first upload to each peer counts)."""
+            peer_id = ids[h]
             def check(pred, msg):
                 check_pred(pred, msg, IllegalUpload, uploads)
 
             not_upload = lambda o: not isinstance(o, Upload)
             check(not_upload, "List of Uploads contains non-Upload object.")
 
-            self_upload = lambda upload: upload.to_id == peer.id
+            self_upload = lambda upload: upload.to_id == peer_id
             check(self_upload, "Can't upload to yourself.")
             
-            not_from_self = lambda upload: upload.from_id != peer.id
+            not_from_self = lambda upload: upload.from_id != peer_id
             check(not_from_self, "Upload.from != peer id.")
 
             check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
 
-            limit = self.up_bw(peer.id)
+            limit = up_bws[h]
             if sum([u.bw for u in uploads]) > limit:
                 raise IllegalUpload("Can't upload more than limit of %d. Attempted to upload %s, for uploads: %s" % (
                     limit, sum([u.bw for u in uploads])), uploads)
 
             # If we got here, looks ok.
-
-        def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
+            rates = dict()
+            for u in uploads:
+                to = handle.get(u.to_id)
+                if to is not None and to not in rates:
+                    rates[to] = u.bw
+            return rates
+
+        def check_requests(h, requests, peer_pieces, available):
+            """Raise an IllegalRequest exception if there is a problem.
+            Otherwise return the requests as (peer handle, parts) pairs,
+            one per Request or RangeRequest, where parts is its list of
+            (piece, start) in priority order."""
+            peer_id = ids[h]
 
             def check(pred, msg):
                 check_pred(pred, msg, IllegalRequest, requests)
 
-            check(lambda o: not isinstance(o, Request),
+            check(lambda o: not isinstance(o, (Request, RangeRequest)),
                   "List of Requests contains non-Request object.")
 
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-            
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
+            bad_peer_id = lambda r: r.peer_id not in handle
             check(bad_peer_id, "Request mentions non-existent peer!")
 
-            bad_requester_id = lambda r: r.requester_id != peer.id
+            not_neighbor = lambda r: not topology.is_neighbor(h, handle[r.peer_id])
+            check(not_neighbor, "Request to a peer that isn't a neighbor!")
+
+            bad_requester_id = lambda r: r.requester_id != peer_id
             check(bad_requester_id, "Request has wrong peer id!")
 
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
-            
+            # The pieces of each request are checked in one pass over its
+            # parts, without building anything per piece.
+            num_pieces = conf.num_pieces
+            blocks_per_piece = conf.blocks_per_piece
+            own = peer_pieces[h]
+            checked = []
+            for r in requests:
+                parts = r.parts()
+                if not isinstance(parts, (list, tuple)):
+                    raise IllegalRequest("Request pieces must be a list of (piece_id, start) pairs. Bad element: %s" % r)
+                has = available[handle[r.peer_id]]
+                for part in parts:
+                    try:
+                        (piece_id, start) = part
+                    except (TypeError, ValueError):
+                        raise IllegalRequest("Request pieces must be a list of (piece_id, start) pairs. Bad element: %s" % r)
+                    # start may be fractional after fractional uploads
+                    if not isinstance(piece_id, int) or not isinstance(start, (int, float)):
+                        raise IllegalRequest("Request piece and start block must be numbers. Bad element: %s" % r)
+                    if piece_id < 0 or piece_id >= num_pieces:
+                        raise IllegalRequest("Request asks for non-existent piece! Bad element: %s" % r)
+                    # Must request the _next_ necessary block
+                    if start < 0 or start >= blocks_per_piece or start > own[piece_id]:
+                        raise IllegalRequest("Request has bad start block! Bad element: %s" % r)
+                    if piece_id not in has:
+                        raise IllegalRequest("Asking for piece peer does not have! Bad element: %s" % r)
+                checked.append((handle[r.peer_id], parts))
+
             # If we got here, looks ok
+            return checked
 
-        def available_pieces(peer_id, peer_pieces):
+        def available_pieces(h, peer_pieces):
             """
             Return a list of piece ids that this peer has available.
             """
-            return [i for i in range(conf.num_pieces) if peer_pieces[peer_id][i] == conf.blocks_per_piece]
-
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-            
-        def all_done(peer_pieces):
+            return [i for i in range(conf.num_pieces) if peer_pieces[h][i] == conf.blocks_per_piece]
+
+        def peer_done(h):
+            return remaining[h] == 0
+
+        def mark_complete(h):
+            """Switch a peer that has every piece to the shared complete
+            representation, dropping its own per-piece state."""
+            available[h] = CompletePieces(conf.num_pieces)
+            peer_info[h] = PeerInfo(ids[h], available[h])
+            peer_pieces[h] = full_pieces
+            pieces_views[h] = full_view
+
+        def all_done():
             result = True
             # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
-                    history.peer_is_done(round, peer_id)
+            for h in range(n):
+                if peer_done(h):
+                    history.peer_is_done(round, ids[h])
                 else:
                     result = False
             return result
@@ -140,259 +239,528 @@ class Sim:
         def create_peers():
             """Each agent class must be already loaded, and have a
             constructor that takes the config, id,  pieces, and
-            up and down bandwidth, in that order."""
-
-            def load(class_name, params):
-                agent_class = conf.agent_classes[class_name]
-                return agent_class(*params)
-
-            counts = dict()
-            def index(name):
-                if name in counts:
-                    a = counts[name]
-                    counts[name] += 1
-                else:
-                    a = 0
-                    counts[name] = 1
-                return a
+            up and down bandwidth, in that order.
 
-            n = len(conf.agent_class_names)
-            ids = ["%s%d" % (n,index(n)) for n in conf.agent_class_names]
+            Returns the ids, the peers (None when they live in a
+            DecisionPool), the peer_pieces list, the upload bandwidths and
+            the DecisionPool (or None).
 
-            is_seed = lambda id: id.startswith("Seed")
+            With conf.reuse_peers, the peers, pool and arrays of the last
+            iteration are reset instead of built again."""
 
-            def get_pieces(id):
-                if id.startswith("Seed"):
-                    return [conf.blocks_per_piece]*conf.num_pieces
-                else:
-                    return [0]*conf.num_pieces
-                
-            peer_pieces = dict()  # id -> list (blocks / piece)
-            peer_pieces = dict((id, get_pieces(id)) for id in ids)
-            pieces = [get_pieces(id) for id in ids]
-            r = itertools.repeat
+            counts = dict()
+            ids = []
+            for name in conf.agent_class_names:
+                i = counts.get(name, 0)
+                counts[name] = i + 1
+                ids.append("%s%d" % (name, i))
+
+            empty = [0]*conf.num_pieces
+            if self.reused_arrays is None:
+                own = [None if id.startswith("Seed") else pieces_array(empty)
+                       for id in ids]
+            else:
+                own = self.reused_arrays
+                zeros = pieces_array(empty)
+                for a in own:
+                    if a is not None:
+                        a[:] = zeros
+            if conf.reuse_peers:
+                self.reused_arrays = own
+            # handle -> array (blocks / piece).  The agent makes its own copy.
+            # Seeds all share full_pieces.
+            peer_pieces = [full_pieces if a is None else a for a in own]
             
             # Re-initialize upload bandwidths at the beginning of each
             # new simulation
             up_bws = [self.up_bw(id, reinit=True) for id in ids] 
-            params = list(zip(r(conf), ids, pieces, up_bws))
 
-            peers = list(map(load, conf.agent_class_names, params))
+            if conf.workers > 0:
+                from parallel import DecisionPool
+                # One seed per peer, so results don't depend on the number
+                # of workers.
+                seeds = [random.getrandbits(32) for id in ids]
+                available = dict((id, available_pieces(h, peer_pieces))
+                                 for (h, id) in enumerate(ids))
+                pieces = [ps.tolist() for ps in peer_pieces]
+                pool = self.reused_pool
+                if pool is None:
+                    pool = DecisionPool(conf, ids, pieces, up_bws, seeds,
+                                        available, conf.workers)
+                else:
+                    pool.reset(pieces, up_bws, seeds, available)
+                if conf.reuse_peers:
+                    self.reused_pool = pool
+                return ids, None, peer_pieces, up_bws, pool
+
+            if self.reused_peers is None:
+                classes = conf.agent_classes
+                peers = [classes[name](conf, id, ps.tolist(), bw) for (name, id, ps, bw)
+                         in zip(conf.agent_class_names, ids, peer_pieces, up_bws)]
+            else:
+                peers = self.reused_peers
+                for (p, ps, bw) in zip(peers, peer_pieces, up_bws):
+                    p.reset(ps.tolist(), bw)
+            if conf.reuse_peers:
+                self.reused_peers = peers
             #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
-            return peers, peer_pieces
-
-        def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
-            def remove_me(info):
-                # TODO: Do we need this linear pass?
-                return [peer for peer in peer_info if peer.id != p.id]
-
-            pieces = copy.copy(peer_pieces[p.id])
-            # Made copy of pieces and the peer info this peer needs to make it's
-            # decision, so that it can't change the simulation's copies.
-            p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
-            return rs
-
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
-            def remove_me(info):
-                # TODO: remove this pass?  Use a set?
-                return [peer for peer in peer_info if peer.id != p.id]
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in list(all_requests.values()):
-                    ans.extend(list(filter(f, rs)))
-                return ans
-
-            requests = requests_to(p.id)
-
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
-            return us
-
-        def upload_rate(uploads, uploader_id, requester_id):
-            """
-            return the uploading rate from uploader to requester
-            in blocks per time period, or 0 if not uploading.
-            """
-            for u in uploads[uploader_id]:
-                if u.to_id == requester_id:
-                    return u.bw
-            return 0
-
-        def update_peer_pieces(peer_pieces, requests, uploads, available):
+            return ids, peers, peer_pieces, up_bws, None
+
+        def neighbor_info(h, peer_info):
+            """The PeerInfo of h's neighbors, as a fresh list the agent
+            is free to reorder."""
+            return [peer_info[q] for q in topology.neighbors_of(h)]
+
+        def get_peer_requests(h, peer_info, peer_history):
+            p = peers[h]
+            # The pieces and the peer info are read-only views, so the agent
+            # can't change the simulation's copies.
+            p.update_pieces(pieces_views[h])
+            return p.requests(neighbor_info(h, peer_info), peer_history)
+
+        def group_requests(all_requests):
+            """list: handle -> the requests sent to that peer, in the order
+            the requesters were asked."""
+            requests_to = [[] for h in range(n)]
+            for rs in all_requests:
+                for r in rs:
+                    requests_to[handle[r.peer_id]].append(r)
+            return requests_to
+
+        def get_peer_uploads(requests, h, peer_info, peer_history):
+            return peers[h].uploads(requests, neighbor_info(h, peer_info),
+                                    peer_history)
+
+        def update_peer_pieces(peer_pieces, requests, upload_bws, available):
             """
             Process the uploads: figure out how many blocks of all the requested
             pieces the requesters ended up with.
             Make sure requesting the same thing from lots of peers doesn't
             stack.
             update the sets of available pieces as needed.
+
+            requests: handle -> [(peer handle, [(piece, start)])]
+            upload_bws: handle -> dict: handle -> bw
+
+            Upload bandwidth a requester doesn't end up using is wasted:
+            the smaller contributions when several uploaders send blocks of
+            the same piece (only the largest counts), whatever is left
+            once the pieces asked of an uploader are finished, and all of
+            an upload to a peer that asked the uploader for nothing or
+            already has every piece.  With conf.reclaim, contributions to
+            the same piece add up instead, and leftover bandwidth goes on
+            to the requester's other requested pieces that the uploader
+            had at the start of the round, in request order.
+
+            peer_pieces is updated in place (agents hold read-only views of
+            it).  Returns the downloads (dict: peer_id -> [Download], or
+            with conf.coalesce_downloads one DownloadBatch per uploader),
+            the list of (handle, piece) that were completed this round, and
+            the list of (uploader id, requester id, blocks) wasted.
             """
             downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
+            completed = []
+            wasted = []
+            # handle -> dict: uploader handle -> bandwidth sent to it
+            incoming = [dict() for h in range(n)]
+            for (peer, bws) in enumerate(upload_bws):
+                for (to, bw) in bws.items():
+                    if bw > 0:
+                        incoming[to][peer] = bw
+            # (handle, piece) completed earlier this round, which the
+            # peer can't pass on before the next one
+            fresh = set()
+            new_pp = peer_pieces
+            for requester in range(n):
+                requester_id = ids[requester]
                 downloads[requester_id] = list()
-            for requester_id in requests:
-                # Keep track of how many blocks of each piece this
-                # requester got.  piece -> (blocks, from_who)
-                new_blocks_per_piece = dict()
-                def update_count(piece_id, blocks, peer_id):
-                    if piece_id in new_blocks_per_piece:
-                        old = new_blocks_per_piece[piece_id][0]
-                        if blocks > old:
-                            new_blocks_per_piece[piece_id] = (blocks, peer_id)
+                granted = incoming[requester]
+                if peer_done(requester):
+                    # Nothing left to download (and its counts are shared)
+                    contributions = []
+                elif conf.reclaim:
+                    contributions = reclaim_bandwidth(
+                        requester, requests[requester], granted,
+                        peer_pieces, available, fresh)
+                else:
+                    contributions = allocate_bandwidth(
+                        requester, requests[requester], granted)
+                if granted:
+                    left = dict(granted)
+                    for (piece_id, blocks, peer) in contributions:
+                        left[peer] -= blocks
+                    for peer in sorted(left, key=id_rank.__getitem__):
+                        if left[peer] > 0:
+                            wasted.append((ids[peer], requester_id, left[peer]))
+
+                batches = dict()  # peer -> DownloadBatch
+                for (piece_id, blocks, peer) in contributions:
+                    a = add_blocks(new_pp[requester], piece_id, blocks)
+                    if a is not new_pp[requester]:
+                        new_pp[requester] = a
+                        pieces_views[requester] = read_only_view(a)
+                    if new_pp[requester][piece_id] == conf.blocks_per_piece:
+                        available[requester].add(piece_id)
+                        completed.append((requester, piece_id))
+                        fresh.add((requester, piece_id))
+                    if conf.coalesce_downloads:
+                        if peer not in batches:
+                            batches[peer] = DownloadBatch(ids[peer], requester_id)
+                            downloads[requester_id].append(batches[peer])
+                        batches[peer].add(piece_id, blocks)
                     else:
-                        new_blocks_per_piece[piece_id] = (blocks, peer_id)
+                        d = Download(ids[peer], requester_id, piece_id, blocks)
+                        downloads[requester_id].append(d)
+                
+            return (downloads, completed, wasted)
 
-                # Group the requests by peer that is being asked
-                get_peer_id = lambda r: r.peer_id
-                rs = sorted(requests[requester_id], key=get_peer_id)
-                for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
-                    bw = upload_rate(uploads, peer_id, requester_id)
+        def allocate_bandwidth(requester, rs, granted):
+            """
+            Each uploader's bandwidth (granted: uploader handle -> blocks
+            sent to the requester) is applied in order to the pieces
+            asked of it; requesting the same piece from several uploaders
+            doesn't stack, only the largest contribution counts.
+            Returns [(piece, blocks, uploader handle)].
+            """
+            # Keep track of how many blocks of each piece this
+            # requester got.  piece -> (blocks, from_who)
+            new_blocks_per_piece = dict()
+            def update_count(piece_id, blocks, peer):
+                if piece_id in new_blocks_per_piece:
+                    old = new_blocks_per_piece[piece_id][0]
+                    if blocks > old:
+                        new_blocks_per_piece[piece_id] = (blocks, peer)
+                else:
+                    new_blocks_per_piece[piece_id] = (blocks, peer)
+
+            # Group the requests by peer that is being asked, in id order
+            get_rank = lambda r: id_rank[r[0]]
+            rs = sorted(rs, key=get_rank)
+            for _, rs_for_peer in itertools.groupby(rs, get_rank):
+                rs_for_peer = list(rs_for_peer)
+                peer = rs_for_peer[0][0]
+                bw = granted.get(peer, 0)
+                if bw == 0:
+                    continue
+                # This bandwidth gets applied in order to each piece
+                # requested, so only the pieces it reaches are looked at
+                for (piece_id, start) in itertools.chain.from_iterable(
+                        parts for (_, parts) in rs_for_peer):
+                    needed_blocks = conf.blocks_per_piece - start
+                    alloced_bw = min(bw, needed_blocks)
+                    update_count(piece_id, alloced_bw, peer)
+                    bw -= alloced_bw
                     if bw == 0:
+                        break
+            return [(piece_id, blocks, peer) for (piece_id, (blocks, peer))
+                    in new_blocks_per_piece.items()]
+
+        def reclaim_bandwidth(requester, rs, granted, peer_pieces, available,
+                              fresh):
+            """
+            Like allocate_bandwidth, but uploaders (in id order) only fill
+            the blocks still missing after the ones before them, and
+            bandwidth left over after the pieces asked of an uploader goes
+            to the requester's next requested pieces that it has.  Pieces
+            in fresh, the (handle, piece) completed earlier this round,
+            don't count as had yet.
+            """
+            # piece -> blocks still missing, filled in as pieces come up
+            missing = dict()
+            def requested(peer):
+                """The requested pieces peer has, in the order first
+                requested; only walked while bandwidth is left."""
+                seen = set()
+                for (_, parts) in rs:
+                    for (piece_id, start) in parts:
+                        if piece_id not in seen:
+                            seen.add(piece_id)
+                            if (piece_id in available[peer] and
+                                (peer, piece_id) not in fresh):
+                                yield piece_id
+            got = dict()  # (piece, peer) -> blocks
+            get_rank = lambda r: id_rank[r[0]]
+            for _, rs_for_peer in itertools.groupby(sorted(rs, key=get_rank),
+                                                    get_rank):
+                rs_for_peer = list(rs_for_peer)
+                peer = rs_for_peer[0][0]
+                bw = granted.get(peer, 0)
+                if bw == 0:
+                    continue
+                asked = (piece_id for (_, parts) in rs_for_peer
+                         for (piece_id, start) in parts)
+                for piece_id in itertools.chain(asked, requested(peer)):
+                    if piece_id not in missing:
+                        missing[piece_id] = (conf.blocks_per_piece -
+                                             peer_pieces[requester][piece_id])
+                    alloced_bw = min(bw, missing[piece_id])
+                    if alloced_bw <= 0:
                         continue
-                    # This bandwidth gets applied in order to each piece requested
-                    for r in rs_for_peer:
-                        needed_blocks = conf.blocks_per_piece - r.start
-                        alloced_bw = min(bw, needed_blocks)
-                        update_count(r.piece_id, alloced_bw, peer_id)
-                        bw -= alloced_bw
-                        if bw == 0:
-                            break
-                for piece_id in new_blocks_per_piece:
-                    (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
-                        available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
-                
-            return (new_pp, downloads)
+                    missing[piece_id] -= alloced_bw
+                    got[(piece_id, peer)] = got.get((piece_id, peer), 0) + alloced_bw
+                    bw -= alloced_bw
+                    if bw == 0:
+                        break
+            return [(piece_id, blocks, peer) for ((piece_id, peer), blocks)
+                    in got.items()]
+
+        def stalled():
+            """True if the swarm has made too little progress over the last
+            conf.stall_rounds rounds: nothing transferred at all, or less
+            than conf.min_throughput blocks per round on average."""
+            if conf.stall_rounds <= 0:
+                return False
+            t = history.recent_throughput(conf.stall_rounds)
+            return t is not None and (t == 0 or t < conf.min_throughput)
 
-        def completed_pieces(peer_id, available):
-            return len(available[peer_id])
-        
         def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
-            log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
-                            for p_id in self.peer_ids)
+            if not logging.getLogger().isEnabledFor(logging.INFO):
+                return
+            for h in range(n):
+                logging.debug("pieces for %s: %s" % (ids[h], str(peer_pieces[h].tolist())))
+            log = ", ".join("%s:%s" % (ids[h], len(available[h]))
+                            for h in range(n))
             logging.info("Pieces completed: " + log)
 
 
         logging.debug("Starting simulation with config: %s" % str(conf))
+        self.notify("start_iteration")
+        self.start_streams()
 
-        peers, peer_pieces = create_peers()
-        self.peer_ids = [p.id for p in peers]
-        self.peers_by_id = dict((p.id, p) for p in peers)
-        
-        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
-
-        # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
-                         for pid in self.peer_ids)
-
-        # Begin the event loop
-        while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
-                         for p in peers]
-            requests = dict()  # peer_id -> list of Requests
-            uploads = dict()   # peer_id -> list of Uploads
-            h = dict()
-            for p in peers:
-                h[p.id] = history.peer_history(p.id)
-                requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
-                                                   available)
-
-            for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-                
+        # The blocks per piece of every peer that has the whole file.
+        full_pieces = pieces_array([conf.blocks_per_piece]*conf.num_pieces)
+        full_view = read_only_view(full_pieces)
 
-            (peer_pieces, downloads) = update_peer_pieces(
-                peer_pieces, requests, uploads, available)
-            history.update(downloads, uploads)
+        ids, peers, peer_pieces, up_bws, pool = create_peers()
+        # Worker processes must not outlive an iteration that fails, even
+        # when they would be reused (the next iteration won't come).
+        try:
+            n = len(ids)
+            handle = dict((id, h) for (h, id) in enumerate(ids))  # id -> handle
+            # handle -> position of the id in sorted order
+            id_rank = [0]*n
+            for (rank, h) in enumerate(sorted(range(n), key=ids.__getitem__)):
+                id_rank[h] = rank
+            self.peer_ids = ids
+            topology = make_topology(conf, n)
+        
+            upload_rates = dict(zip(ids, up_bws))
+            trace = None
+            if conf.trace_dir is not None:
+                from simtrace import TraceWriter
+                path = os.path.join(conf.trace_dir, "iter%06d.trace" % self.iteration)
+                trace = TraceWriter(path, ids, upload_rates)
+            history = History(ids, upload_rates, trace)
+
+            # list : handle -> set(finished / available pieces).  Peers that
+            # have everything get a CompletePieces instead, see mark_complete().
+            available = [set(available_pieces(h, peer_pieces)) for h in range(n)]
+            # list : handle -> number of pieces the peer still needs
+            remaining = [conf.num_pieces - len(a) for a in available]
+
+            # What agents get to see.  These are live, read-only views of the
+            # arrays and sets above, so they never need to be copied or rebuilt.
+            pieces_views = [read_only_view(ps) for ps in peer_pieces]
+            peer_info = [PeerInfo(ids[h], AvailableView(available[h])) for h in range(n)]
+            for h in range(n):
+                if peer_done(h):
+                    mark_complete(h)
+
+            # What the decision pool hasn't seen yet: pieces completed and the
+            # downloads and uploads of the last round.
+            completed = []
+            downloads = dict()
+            uploads = dict()
+
+            if self.observers:
+                self.notify("start_rounds", history,
+                            [pi.available_pieces for pi in peer_info])
+
+            # Begin the event loop
+            while True:
+                logging.info("======= Round %d ========" % round)
+
+                topology_changed = topology.refresh(round)
+                if pool is not None:
+                    neighbors = None
+                    if topology_changed:
+                        neighbors = dict((ids[h], [ids[q] for q in topology.neighbors_of(h)])
+                                         for h in range(n))
+                    requests = pool.requests([(ids[h], piece) for (h, piece) in completed],
+                                             downloads, uploads, neighbors)
+                    requests = [requests[id] for id in ids]
+                else:
+                    requests = []  # handle -> list of Requests
+                    peer_histories = []
+                    for h in range(n):
+                        peer_histories.append(history.peer_history(ids[h]))
+                        requests.append(get_peer_requests(h, peer_info, peer_histories[h]))
+                reqs = [check_requests(h, requests[h], peer_pieces, available)
+                        for h in range(n)]
+
+                if pool is not None:
+                    uploads = pool.uploads(dict(zip(ids, requests)))
+                else:
+                    requests_to = group_requests(requests)
+                    uploads = dict()   # peer_id -> list of Uploads
+                    for h in range(n):
+                        uploads[ids[h]] = get_peer_uploads(requests_to[h], h,
+                                                           peer_info, peer_histories[h])
+                upload_bws = [check_uploads(h, uploads[ids[h]]) for h in range(n)]
+
+                (downloads, completed, wasted) = update_peer_pieces(
+                    peer_pieces, reqs, upload_bws, available)
+                for (h, piece) in completed:
+                    remaining[h] -= 1
+                    if remaining[h] == 0:
+                        mark_complete(h)
+                history.update(downloads, uploads, wasted)
+
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(history.pretty_for_round(round))
+
+                log_peer_info(peer_pieces, available)
+           
+                done = all_done()
+                if self.observers:
+                    self.notify("end_round", round, history,
+                                [(ids[h], piece) for (h, piece) in completed])
+                if done:
+                    logging.info("All done!")                    
+                    history.end_reason = "done"
+                    break
+                if stalled():
+                    logging.info("Stalled: %s blocks per round over the last %d rounds.  Stopping." %
+                                 (history.recent_throughput(conf.stall_rounds),
+                                  conf.stall_rounds))
+                    history.end_reason = "stalled"
+                    break
+                round += 1
+                if round > conf.max_round:
+                    logging.info("Out of time.  Stopping.")
+                    history.end_reason = "max_round"
+                    break
+        except BaseException:
+            if pool is not None:
+                pool.close()
+                self.reused_pool = None
+            raise
+
+        if pool is not None and not conf.reuse_peers:
+            pool.close()
+        history.close_trace({"iteration": self.iteration,
+                             "end_reason": history.end_reason,
+                             "rounds": history.last_round() + 1})
+        self.notify("end_iteration", history)
+
+        # The per-iteration report is only built when it will be shown.
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("Game history:\n%s" % history.pretty())
+
+            logging.info("======== STATS ========")
+            logging.info("Uploaded blocks:\n%s" %
+                         Stats.uploaded_blocks_str(ids, history))
+            logging.info("Completion rounds:\n%s" %
+                         Stats.completion_rounds_str(ids, history))
+            logging.info("Wasted blocks (as uploader, as requester):\n%s" %
+                         Stats.wasted_blocks_str(ids, history))
+            logging.info("All done round: %s" %
+                         Stats.all_done_round(ids, history))
+            logging.info("Ended: %s" % history.end_reason)
 
-            logging.debug(history.pretty_for_round(round))
+        return history
 
-            log_peer_info(peer_pieces, available)
-           
-            if all_done(peer_pieces):
-                logging.info("All done!")                    
-                break
-            round += 1
-            if round > conf.max_round:
-                logging.info("Out of time.  Stopping.")
+    def release_peers(self):
+        """Drop the peers kept by config.reuse_peers, stopping their worker
+        processes if there are any."""
+        if self.reused_pool is not None:
+            self.reused_pool.close()
+        self.reused_peers = None
+        self.reused_pool = None
+        self.reused_arrays = None
+
+    def run_sim(self, keep_histories=False):
+        """Run config.iters iterations and log the summary.  Each History is
+        folded into a RunSummary as soon as its iteration ends and then
+        dropped, unless keep_histories is set.  Returns the RunSummary.
+
+        With config.target_ci set, config.iters is only an upper bound:
+        iterations stop once every agent class's estimates are settled
+        (see RunSummary.settled), after at least config.min_iters."""
+        conf = self.config
+        if conf.seed is not None:
+            random.seed(conf.seed)
+        summary = None
+        for i in range(conf.iters):
+            self.iteration = i
+            history = self.run_sim_once()
+            if summary is None:
+                summary = RunSummary(self.peer_ids, conf.agent_class_names,
+                                     keep_histories)
+            summary.add(history)
+            del history
+            if (conf.target_ci is not None and summary.iters >= conf.min_iters
+                and summary.settled(conf.target_ci)):
+                logging.warning("Estimates settled after %d iterations" %
+                                summary.iters)
                 break
+        self.release_peers()
+        self.notify("end_run", summary)
+        log_summary(summary)
+        return summary
 
-        logging.info("Game history:\n%s" % history.pretty())
 
-        logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
-                     Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
-                     Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
-                     Stats.all_done_round(self.peer_ids, history))
 
-        return history
+def log_summary(summary):
+    """Log the stats of a RunSummary over all its iterations."""
+    logging.warning("======== SUMMARY STATS ========")
+    if set(summary.end_reasons) != set(["done"]):
+        logging.warning("Iterations by end reason: %s" % ", ".join(
+            "%s %d" % (r, c) for (r, c) in sorted(summary.end_reasons.items())))
 
-    def run_sim(self):
-        histories = [self.run_sim_once() for i in range(self.config.iters)]
-        logging.warning("======== SUMMARY STATS ========")
-        
-        uploaded_blocks = [Stats.uploaded_blocks(self.peer_ids, h) for h in histories]
-        completion_rounds = [Stats.completion_rounds(self.peer_ids, h) for h in histories]
-
-        def extract_by_peer_id(lst, peer_id):
-            """Given a list of dicts, pull out the entry
-            for peer_id from each dict.  Return a list"""
-            return [d[peer_id] for d in lst]
-
-        uploaded_by_id = dict(
-            (p_id, extract_by_peer_id(uploaded_blocks, p_id))
-            for p_id in self.peer_ids)
-
-        completion_by_id = dict(
-            (p_id, extract_by_peer_id(completion_rounds, p_id))
-            for p_id in self.peer_ids)
-
-        logging.warning("Uploaded blocks: avg (stddev)")
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: mean(uploaded_by_id[id])):
-            us = uploaded_by_id[p_id]
-            logging.warning("%s: %.1f  (%.1f)" % (p_id, mean(us), stddev(us)))
-
-        logging.warning("Completion rounds: avg (stddev)")
-
-        def optionize(f):
-            def g(lst):
-                if None in lst:
-                    return None
-                else:
-                    return f(lst)
-            return g
+    uploaded = summary.uploaded
+    logging.warning("Uploaded blocks: avg (stddev)")
+    for p_id in sorted(summary.peer_ids,
+                       key=lambda id: uploaded[id].mean()):
+        us = uploaded[p_id]
+        logging.warning("%s: %.1f  (%.1f)" % (p_id, us.mean(), us.stddev()))
 
-        opt_mean = optionize(mean)
-        opt_stddev = optionize(stddev)
-        
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: opt_mean(completion_by_id[id]) or 0):
-            cs = completion_by_id[p_id]
-            logging.warning("%s: %s  (%s)" % (p_id, opt_mean(cs), opt_stddev(cs)))
+    logging.warning("Completion rounds: avg (stddev)")
+
+    for p_id in sorted(summary.peer_ids,
+                       key=lambda id: summary.completion_mean(id) or 0):
+        logging.warning("%s: %s  (%s)" % (p_id, summary.completion_mean(p_id),
+                                          summary.completion_stddev(p_id)))
 
+    logging.warning("Wasted upload blocks per iteration: %.1f (%.1f%% of the bandwidth used)"
+                    % (summary.wasted.mean(), 100 * summary.wasted_fraction()))
 
+    def ci_str(s, fmt="%.1f"):
+        if s is None:
+            return "None"
+        hw = s.ci95()
+        return (fmt % s.mean()) + ("" if hw is None else (" +/- " + fmt % hw))
 
-def configure_logging(loglevel):
+    logging.warning("Per class over %d iterations: uploaded blocks, completion round (95%% CI)"
+                    % summary.iters)
+    for c in summary.classes:
+        logging.warning("%s: %s, %s" % (c, ci_str(summary.class_uploaded[c]),
+                                        ci_str(summary.class_completion[c], "%.2f")))
+
+
+def configure_logging(loglevel, flush_interval=0):
+    """Log to stdout.  With a positive flush_interval (seconds), records are
+    written in batches by a background thread; see logqueue.py."""
     numeric_level = getattr(logging, loglevel.upper(), None)
     if not isinstance(numeric_level, int):
         raise ValueError('Invalid log level: %s' % loglevel)
 
+    if flush_interval > 0:
+        import logqueue
+        logqueue.install(numeric_level, sys.__stdout__,
+                         flush_interval=flush_interval)
+        return
+
     root_logger = logging.getLogger('')
     strm_out = logging.StreamHandler(sys.__stdout__)
 #    strm_out.setFormatter(logging.Formatter('%(levelno)s: %(message)s'))
@@ -422,15 +790,12 @@ def parse_agents(args):
             
         
 
-def main(args):
+def make_parser():
+    """The command-line options of sim.py.  Their defaults are also the
+    defaults of every other way of building a config (see make_config)."""
     usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
     parser = OptionParser(usage=usage_msg)
 
-    def usage(msg):
-        print(("Error: %s\n" % msg))
-        parser.print_help()
-        sys.exit()
-    
     parser.add_option("--loglevel",
                       dest="loglevel", default="info",
                       help="Set the logging level: 'debug' or 'info'")
@@ -459,24 +824,131 @@ def main(args):
                       dest="iters", default=1, type="int",
                       help="Number of times to run simulation to get stats")
 
+    parser.add_option("--log-flush-interval",
+                      dest="log_flush_interval", default=0.2, type="float",
+                      help="Write log output in batches at most this many seconds apart (0: unbuffered)")
 
-    (options, args) = parser.parse_args()
+    parser.add_option("--trace-dir",
+                      dest="trace_dir", default=None,
+                      help="Write a binary trace of every iteration to this directory")
 
-    # leftover args are class names, with optional counts:
-    # "Peer Seed[,4]"
+    parser.add_option("--topology",
+                      dest="topology", default="full",
+                      choices=["full", "regular", "tracker"],
+                      help="Who can see whom: 'full', 'regular' (random DEGREE-regular graph) or 'tracker' (up to DEGREE random peers, re-drawn every REFRESH rounds)")
 
-    if len(args) == 0:
-        # default
-        agents_to_run = ['Dummy', 'Dummy', 'Seed']
-    else:
-        try:
-            agents_to_run = parse_agents(args)
-        except ValueError as e:
-            usage(e)
-    
-    configure_logging(options.loglevel)
-    config = Params()
+    parser.add_option("--degree",
+                      dest="degree", default=50, type="int",
+                      help="Number of neighbors per peer with --topology=regular (at most that many with tracker)")
+
+    parser.add_option("--refresh",
+                      dest="refresh", default=10, type="int",
+                      help="Rounds between tracker neighbor refreshes with --topology=tracker")
+
+    parser.add_option("--target-ci",
+                      dest="target_ci", default=None, type="float",
+                      help="Stop iterating once every class's 95%% CI is within this fraction of its mean (--iters becomes the maximum)")
+
+    parser.add_option("--min-iters",
+                      dest="min_iters", default=3, type="int",
+                      help="Minimum number of iterations with --target-ci")
+
+    parser.add_option("--stall-rounds",
+                      dest="stall_rounds", default=0, type="int",
+                      help="End an iteration early once the swarm has stalled for this many rounds (0: never)")
+
+    parser.add_option("--min-throughput",
+                      dest="min_throughput", default=0, type="float",
+                      help="With --stall-rounds, also count as stalled when fewer than this many blocks per round were transferred")
+
+    parser.add_option("--coalesce-downloads",
+                      dest="coalesce_downloads", default=False,
+                      action="store_true",
+                      help="Record one DownloadBatch per uploader and round instead of one Download per piece")
+
+    parser.add_option("--reclaim",
+                      dest="reclaim", default=False, action="store_true",
+                      help="Give upload bandwidth a requester can't use on the pieces it asked for to its other requested pieces that the uploader had at the start of the round.  Uploads to peers that asked the uploader for nothing or are complete are still wasted")
+
+    parser.add_option("--reuse-peers",
+                      dest="reuse_peers", default=False, action="store_true",
+                      help="Build the agents once and reset() them between iterations")
+
+    parser.add_option("--profile",
+                      dest="profile", default="none",
+                      choices=["none", "cprofile", "sampling", "tracemalloc"],
+                      help="Profile the simulation: 'none', 'cprofile', 'sampling' or 'tracemalloc' (see profiling.py)")
+
+    parser.add_option("--profile-out",
+                      dest="profile_out", default="profile",
+                      help="Prefix of the profile output files (PREFIX.collapsed, PREFIX.prof)")
+
+    parser.add_option("--profile-top",
+                      dest="profile_top", default=20, type="int",
+                      help="Number of rows in the profile tables")
+
+    parser.add_option("--profile-interval",
+                      dest="profile_interval", default=0.005, type="float",
+                      help="Seconds between samples with --profile=sampling")
+
+    parser.add_option("--metrics",
+                      dest="metrics", default=None,
+                      help="Write per-round swarm metrics to this file (see metrics.py)")
+
+    parser.add_option("--metrics-format",
+                      dest="metrics_format", default="csv",
+                      choices=["csv", "jsonl", "prom"],
+                      help="Format of --metrics: 'csv', 'jsonl' or 'prom' (a Prometheus text snapshot of the latest round)")
+
+    parser.add_option("--db",
+                      dest="db", default=None,
+                      help="Record every iteration's results in this SQLite database (see resultstore.py)")
+
+    parser.add_option("--db-batch",
+                      dest="db_batch", default=100, type="int",
+                      help="Iterations per --db transaction")
+
+    parser.add_option("--progress",
+                      dest="progress", default=False, action="store_true",
+                      help="Show iteration, round, throughput, peers done and ETA on stderr while running")
+
+    parser.add_option("--progress-interval",
+                      dest="progress_interval", default=0.5, type="float",
+                      help="Seconds between --progress updates")
+
+    parser.add_option("--mem-report",
+                      dest="mem_report", default=False, action="store_true",
+                      help="Report memory use per agent class and engine part after every iteration (slow; see memreport.py)")
+
+    parser.add_option("--mem-every",
+                      dest="mem_every", default=1, type="int",
+                      help="Rounds between memory snapshots with --mem-report")
+
+    parser.add_option("--mem-out",
+                      dest="mem_out", default=None,
+                      help="With --mem-report, also write every snapshot to this tab-separated file")
 
+    parser.add_option("--seed",
+                      dest="seed", default=None, type="int",
+                      help="Seed the random number generator")
+
+    parser.add_option("--crn-seed",
+                      dest="crn_seed", default=None, type="int",
+                      help="Common random numbers: draw each iteration's bandwidths and random state from this seed and the iteration number, so different agent mixes see the same draws (see compare.py)")
+
+    parser.add_option("--workers",
+                      dest="workers", default=0, type="int",
+                      help="Evaluate agent decisions in this many worker processes (0: in-process)")
+
+    return parser
+
+
+def make_config(options, agents_to_run):
+    """The Sim config for parsed options and a list of agent class names
+    (one per peer)."""
+    if options.trace_dir is not None and not os.path.isdir(options.trace_dir):
+        os.makedirs(options.trace_dir)
+    config = Params()
     config.add("agent_class_names", agents_to_run)
     config.add("agent_classes", load_modules(config.agent_class_names))
 
@@ -487,13 +959,70 @@ def main(args):
     config.add("min_up_bw", options.min_up_bw)
     config.add("max_up_bw", options.max_up_bw)
     config.add("iters", options.iters)
+    config.add("topology", options.topology)
+    config.add("degree", options.degree)
+    config.add("refresh", options.refresh)
+    config.add("target_ci", options.target_ci)
+    config.add("min_iters", options.min_iters)
+    config.add("stall_rounds", options.stall_rounds)
+    config.add("min_throughput", options.min_throughput)
+    config.add("coalesce_downloads", options.coalesce_downloads)
+    config.add("reuse_peers", options.reuse_peers)
+    config.add("reclaim", options.reclaim)
+    config.add("seed", options.seed)
+    config.add("crn_seed", options.crn_seed)
+    config.add("trace_dir", options.trace_dir)
+    config.add("workers", options.workers)
+    return config
+
+
+def main(args):
+    parser = make_parser()
+
+    def usage(msg):
+        print(("Error: %s\n" % msg))
+        parser.print_help()
+        sys.exit()
+
+    (options, args) = parser.parse_args(args[1:])
+
+    # leftover args are class names, with optional counts:
+    # "Peer Seed[,4]"
+
+    if len(args) == 0:
+        # default
+        agents_to_run = ['Dummy', 'Dummy', 'Seed']
+    else:
+        try:
+            agents_to_run = parse_agents(args)
+        except ValueError as e:
+            usage(e)
+    
+    configure_logging(options.loglevel, options.log_flush_interval)
+    config = make_config(options, agents_to_run)
     
     sim = Sim(config)
-    sim.run_sim()
+    if options.metrics is not None:
+        from metrics import MetricsWriter
+        sim.add_observer(MetricsWriter(options.metrics, options.metrics_format,
+                                       config.agent_class_names))
+    if options.db is not None:
+        from resultstore import ResultStore
+        sim.add_observer(ResultStore(options.db, options.db_batch))
+    if options.progress:
+        from progress import ProgressReporter
+        sim.add_observer(ProgressReporter(options.progress_interval))
+    if options.mem_report:
+        from memreport import MemoryReport
+        sim.add_observer(MemoryReport(config.agent_classes, options.mem_every,
+                                      options.mem_out))
+    if options.profile == "none":
+        sim.run_sim()
+    else:
+        import profiling
+        profiling.run(options.profile, sim.run_sim, config.agent_classes,
+                      options.profile_out, options.profile_top,
+                      options.profile_interval)
 
 if __name__ == "__main__":
-
-    # The next two lines are for profiling...
-    import cProfile
-    cProfile.run('main(sys.argv)', 'out.prof')
-#    main(sys.argv)
\ No newline at end of file
+    main(sys.argv)
\ No newline at end of file
@@ -0,0 +1,450 @@
+#!/usr/bin/python
+
+"""
+Simulation service: a pool of warm worker processes, with the simulator and
+the agent classes already imported, that runs jobs from a queue and streams
+each iteration's results back as soon as it ends.  Saves the interpreter
+start and imports that every `python sim.py ...` pays.
+
+Serve (on a Unix socket, or on localhost with --port):
+
+  python simservice.py [--socket=PATH | --port=N] [--pool=N] [AgentClass ...]
+
+Submit a job and print its events:
+
+  python simservice.py --submit [--socket=PATH | --port=N] [--sweep=NAME=V1,V2]
+      -- [sim.py options] PeerClass[,count] ...
+
+A job is a JSON object.  "args" are sim.py's command-line arguments;
+"sweep" optionally maps option names (as in sim.py's make_parser, e.g.
+"seed" or "num_pieces") to lists of values, and the job is run once for
+every combination:
+
+  {"args": ["--num-pieces=20", "--iters=5", "TodoketeStd,3", "Seed,1"],
+   "sweep": {"seed": [1, 2, 3]}}
+
+The options sim.py handles around the simulation (--metrics, --db,
+--progress, --profile, --mem-report) and --help are rejected.
+
+Send one job per line on the socket, or POST one to /jobs over HTTP
+(GET /status reports the queue).  Events come back one JSON object per
+line (a chunked application/x-ndjson response over HTTP):
+
+  {"event": "queued", "job": 1, "runs": 3}
+  {"event": "iteration", "job": 1, "run": 0, "params": {"seed": 1},
+   "iteration": 0, "rounds": 27, "end_reason": "done",
+   "uploaded": {peer: blocks}, "completion": {peer: round or null}}
+  {"event": "run_done", "job": 1, "run": 0, "params": {"seed": 1},
+   "iters": 5, "classes": {class: {"uploaded": mean, "completion": mean}}}
+  {"event": "error", "job": 1, "run": 0, "message": "..."}
+  {"event": "done", "job": 1}
+
+Runs of a job may finish in any order.  Runs not started yet when the
+client goes away are dropped.
+"""
+
+import os
+import sys
+import copy
+import json
+import signal
+import socket
+import asyncio
+import logging
+import itertools
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+from sim import Sim, make_parser, make_config, parse_agents, configure_logging
+from stats import Stats
+from util import load_modules
+
+DEFAULT_AGENTS = ["Dummy", "Seed", "TodoketeStd", "TodoketeTyrant",
+                  "TodoketePropShare", "TodoketeTourney"]
+DEFAULT_SOCKET = "simservice.sock"
+# sim.py options that main() handles outside the Sim; a job can't use them
+UNSUPPORTED_OPTIONS = ["metrics", "db", "progress", "profile", "mem_report"]
+
+
+class JobError(Exception):
+    pass
+
+
+def parse_job(job):
+    """
+    job: dict as described above.
+    Returns [(options, agent class names, swept params)], one per run.
+    Raises JobError if the job doesn't make sense.
+    """
+    if not isinstance(job, dict):
+        raise JobError("A job must be a JSON object")
+    parser = make_parser()
+    def error(msg):
+        raise JobError(msg)
+    def exit(status=0, msg=None):
+        # After --help optparse would exit, taking the service with it
+        raise JobError(msg or "--help isn't supported in jobs")
+    parser.error = error
+    parser.exit = exit
+    parser.print_help = lambda file=None: None
+    (options, args) = parser.parse_args([str(a) for a in job.get("args", [])])
+    defaults = parser.get_default_values()
+    try:
+        agents = parse_agents(args) if args else ['Dummy', 'Dummy', 'Seed']
+        load_modules(agents)
+    except (ValueError, ImportError, KeyError) as e:
+        raise JobError("Bad agent list: %s" % e)
+
+    sweep = job.get("sweep") or {}
+    for (name, values) in sweep.items():
+        if not hasattr(options, name):
+            raise JobError("Unknown option in sweep: %s" % name)
+        if not isinstance(values, list) or not values:
+            raise JobError("Sweep values of %s must be a non-empty list" % name)
+    for name in UNSUPPORTED_OPTIONS:
+        if name in sweep or getattr(options, name) != getattr(defaults, name):
+            raise JobError("--%s isn't supported in jobs" % name.replace("_", "-"))
+    names = sorted(sweep)
+    runs = []
+    for values in itertools.product(*[sweep[name] for name in names]):
+        params = dict(zip(names, values))
+        o = copy.copy(options)
+        for (name, v) in params.items():
+            setattr(o, name, v)
+        runs.append((o, agents, params))
+    return runs
+
+
+# Worker processes
+
+_events = None  # queue shared with the service, set by _init_worker
+
+def _init_worker(agent_names, events):
+    global _events
+    _events = events
+    # The summaries sim.py logs go to the client as events instead
+    logging.getLogger().setLevel(logging.ERROR)
+    load_modules(agent_names)
+
+
+def _ping():
+    return os.getpid()
+
+
+class IterationReporter:
+    """Sim observer that sends every iteration's results to the service."""
+    def __init__(self, job_id, run, params):
+        self.base = {"job": job_id, "run": run, "params": params}
+
+    def end_iteration(self, sim, history):
+        ids = sim.peer_ids
+        e = dict(self.base, event="iteration", iteration=sim.iteration,
+                 rounds=history.last_round() + 1,
+                 end_reason=history.end_reason,
+                 uploaded=Stats.uploaded_blocks(ids, history),
+                 completion=Stats.completion_rounds(ids, history))
+        _events.put(e)
+
+
+def run_one(job_id, run, options, agents, params):
+    """Run one run of a job in a worker.  Everything, including failures,
+    is reported through the event queue."""
+    base = {"job": job_id, "run": run, "params": params}
+    try:
+        sim = Sim(make_config(options, agents))
+        sim.add_observer(IterationReporter(job_id, run, params))
+        summary = sim.run_sim()
+        classes = dict()
+        for c in summary.classes:
+            completion = summary.class_completion[c]
+            classes[c] = {"uploaded": summary.class_uploaded[c].mean(),
+                          "completion": None if completion is None else completion.mean()}
+        _events.put(dict(base, event="run_done", iters=summary.iters,
+                         classes=classes))
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        _events.put(dict(base, event="error", message="%s: %s" % (
+            type(e).__name__, e)))
+
+
+# The service
+
+class Job:
+    def __init__(self, job_id, runs, send):
+        self.id = job_id
+        self.runs = runs
+        self.left = len(runs)
+        self.send = send                # function event -> False if the client is gone
+        self.cancelled = False
+        self.finished = asyncio.Event()
+
+
+class SimService:
+    def __init__(self, pool_size, agent_names):
+        self.pool_size = pool_size
+        self.manager = multiprocessing.Manager()
+        self.events = self.manager.Queue()
+        self.pool = ProcessPoolExecutor(pool_size, initializer=_init_worker,
+                                        initargs=(agent_names, self.events))
+        self.queue = asyncio.Queue()    # (Job, run index)
+        self.jobs = dict()              # job id -> Job
+        self.job_ids = itertools.count(1)
+        self.running = 0
+
+    async def start(self):
+        """Start the workers (and wait until they are up), the dispatchers
+        and the thread that forwards the workers' events."""
+        self.loop = asyncio.get_running_loop()
+        await asyncio.gather(*[self.loop.run_in_executor(self.pool, _ping)
+                               for i in range(self.pool_size)])
+        self.dispatchers = [asyncio.create_task(self.dispatch())
+                            for i in range(self.pool_size)]
+        self.pump = threading.Thread(target=self.forward_events, daemon=True,
+                                     name="simservice-events")
+        self.pump.start()
+
+    def close(self):
+        for t in self.dispatchers:
+            t.cancel()
+        self.events.put(None)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
+
+    def submit(self, job, send):
+        """Queue a job (a dict).  send(event) is called with every event of
+        the job.  Raises JobError if the job is malformed."""
+        runs = parse_job(job)
+        j = Job(next(self.job_ids), runs, send)
+        self.jobs[j.id] = j
+        send({"event": "queued", "job": j.id, "runs": len(runs)})
+        for run in range(len(runs)):
+            self.queue.put_nowait((j, run))
+        logging.info("Job %d: %d runs queued" % (j.id, len(runs)))
+        return j
+
+    async def dispatch(self):
+        """Keep one worker busy with runs from the queue."""
+        while True:
+            (job, run) = await self.queue.get()
+            if job.cancelled:
+                self.run_finished(job)
+                continue
+            (options, agents, params) = job.runs[run]
+            self.running += 1
+            try:
+                await self.loop.run_in_executor(self.pool, run_one, job.id,
+                                                run, options, agents, params)
+            except Exception as e:
+                # The pool itself failed; the worker couldn't report it
+                self.deliver({"event": "error", "job": job.id, "run": run,
+                              "params": params, "message": str(e)})
+            finally:
+                self.running -= 1
+
+    def forward_events(self):
+        """Thread: move the workers' events to the event loop."""
+        while True:
+            e = self.events.get()
+            if e is None:
+                return
+            self.loop.call_soon_threadsafe(self.deliver, e)
+
+    def deliver(self, e):
+        job = self.jobs.get(e["job"])
+        if job is None:
+            return
+        if not job.cancelled and not job.send(e):
+            job.cancelled = True
+        if e["event"] in ("run_done", "error"):
+            self.run_finished(job)
+
+    def run_finished(self, job):
+        job.left -= 1
+        if job.left == 0:
+            if not job.cancelled:
+                job.send({"event": "done", "job": job.id})
+            logging.info("Job %d finished" % job.id)
+            del self.jobs[job.id]
+            job.finished.set()
+
+    def status(self):
+        return {"workers": self.pool_size, "queued": self.queue.qsize(),
+                "running": self.running, "jobs": len(self.jobs)}
+
+    # Connections
+
+    async def handle(self, reader, writer):
+        try:
+            first = await reader.readline()
+            if first.split(b" ", 1)[0] in (b"GET", b"POST"):
+                await self.handle_http(first, reader, writer)
+            else:
+                await self.handle_lines(first, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_lines(self, line, reader, writer):
+        """One job per line; events of all of them as lines."""
+        def send(e):
+            if writer.is_closing():
+                return False
+            writer.write(json.dumps(e).encode() + b"\n")
+            return True
+
+        jobs = []
+        while line:
+            if line.strip():
+                try:
+                    jobs.append(self.submit(json.loads(line), send))
+                except (ValueError, JobError) as e:
+                    send({"event": "error", "job": None, "message": str(e)})
+            await writer.drain()
+            line = await reader.readline()
+        # The client is done sending; finish its jobs before closing
+        for j in jobs:
+            await j.finished.wait()
+        await writer.drain()
+
+    async def handle_http(self, request_line, reader, writer):
+        """Just enough HTTP/1.1 for POST /jobs and GET /status."""
+        parts = request_line.decode("latin-1").split()
+        (method, path) = (parts[0], parts[1] if len(parts) > 1 else "/")
+        length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            (name, _, value) = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        body = await reader.readexactly(length) if length else b""
+
+        def respond(code, reason, obj):
+            data = json.dumps(obj).encode() + b"\n"
+            writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                          "Content-Length: %d\r\nConnection: close\r\n\r\n"
+                          % (code, reason, len(data))).encode() + data)
+
+        if method == "GET" and path == "/status":
+            respond(200, "OK", self.status())
+        elif method == "POST" and path == "/jobs":
+            def send(e):
+                if writer.is_closing():
+                    return False
+                data = json.dumps(e).encode() + b"\n"
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                return True
+            try:
+                job = json.loads(body)
+                parse_job(job)
+            except (ValueError, JobError) as e:
+                respond(400, "Bad Request", {"error": str(e)})
+            else:
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                             b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+                j = self.submit(job, send)
+                await j.finished.wait()
+                if not writer.is_closing():
+                    writer.write(b"0\r\n\r\n")
+        else:
+            respond(404, "Not Found", {"error": "Use POST /jobs or GET /status"})
+        await writer.drain()
+
+
+async def serve(options, agent_names):
+    service = SimService(options.pool, agent_names)
+    await service.start()
+    if options.port:
+        server = await asyncio.start_server(service.handle, "127.0.0.1",
+                                            options.port)
+        where = "127.0.0.1:%d" % options.port
+    else:
+        if os.path.exists(options.socket):
+            os.unlink(options.socket)
+        server = await asyncio.start_unix_server(service.handle, options.socket)
+        where = options.socket
+    logging.warning("Serving on %s with %d workers" % (where, options.pool))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        service.close()
+        if not options.port and os.path.exists(options.socket):
+            os.unlink(options.socket)
+
+
+def submit(job, path=DEFAULT_SOCKET, port=None):
+    """Send a job to a running service and yield its events as they come,
+    up to and including "done"."""
+    if port:
+        s = socket.create_connection(("127.0.0.1", port))
+    else:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(path)
+    with s:
+        s.sendall(json.dumps(job).encode() + b"\n")
+        s.shutdown(socket.SHUT_WR)
+        for line in s.makefile("rb"):
+            e = json.loads(line)
+            yield e
+            if e["event"] == "done" or (e["event"] == "error" and e["job"] is None):
+                return
+
+
+def parse_sweep(specs):
+    """["seed=1,2,3", ...] -> {"seed": [1, 2, 3]}; values are JSON if they
+    parse as JSON, strings otherwise."""
+    def value(v):
+        try:
+            return json.loads(v)
+        except ValueError:
+            return v
+    sweep = dict()
+    for spec in specs:
+        (name, _, values) = spec.partition("=")
+        sweep[name.replace("-", "_")] = [value(v) for v in values.split(",")]
+    return sweep
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options] [AgentClass ...]\n"
+                          "       %prog --submit [options] -- [sim.py options] PeerClass[,count] ...")
+    parser.add_option("--socket", dest="socket", default=DEFAULT_SOCKET,
+                      help="Unix socket to serve on or submit to")
+    parser.add_option("--port", dest="port", default=0, type="int",
+                      help="Use this localhost TCP port (HTTP or JSON lines) instead of the socket")
+    parser.add_option("--pool", dest="pool", default=os.cpu_count() or 1, type="int",
+                      help="Number of worker processes")
+    parser.add_option("--loglevel", dest="loglevel", default="info",
+                      help="Logging level of the service")
+    parser.add_option("--submit", dest="submit", default=False, action="store_true",
+                      help="Send the sim.py arguments after -- as a job and print the events")
+    parser.add_option("--sweep", dest="sweep", default=[], action="append",
+                      help="With --submit, run the job for each value: NAME=V1,V2,...")
+    (options, args) = parser.parse_args(args[1:])
+
+    if options.submit:
+        job = {"args": args}
+        if options.sweep:
+            job["sweep"] = parse_sweep(options.sweep)
+        for e in submit(job, options.socket, options.port):
+            print(json.dumps(e))
+            sys.stdout.flush()
+        return
+
+    configure_logging(options.loglevel)
+    try:
+        asyncio.run(serve(options, args or DEFAULT_AGENTS))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv)
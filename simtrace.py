@@ -0,0 +1,285 @@
+#!/usr/bin/python
+
+"""
+Compact binary trace of a simulation history.
+
+Layout of a trace file:
+
+  magic       8 bytes  b"BTTRACE3"
+  records     one varint-encoded (round, from, to, piece, blocks) tuple per
+              piece downloaded, grouped by round.  Peers are interned as their
+              index in the peer table.  blocks is stored doubled; an odd
+              value 1 means a little-endian double follows instead (agents
+              may upload fractional bandwidths).
+  peer table  varint count, then per peer: varint name length, utf-8 name,
+              varint upload rate
+  done table  varint count, then per finished peer: varint peer, varint round
+  meta        varint length, utf-8 JSON object (e.g. why the run ended)
+  index       num_rounds + 1 little-endian uint64 offsets; round r's records
+              are in [index[r], index[r+1])
+  peer index  num_peers + 1 little-endian uint64 offsets of the peers' record
+              lists, then for each peer the list: the offsets of the records
+              it uploaded or downloaded in, as varint deltas from the
+              previous one (the first from 0)
+  trailer     4 little-endian uint64s: offset of the peer table, offset of
+              the index, number of rounds, offset of the peer index, and the
+              magic b"BTTRIDX2"
+
+The indexes and the records are read through a memory map, so one round or
+one peer can be pulled out of a huge trace without reading the rest.
+"""
+
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from messages import Download
+
+MAGIC = b"BTTRACE3"
+INDEX_MAGIC = b"BTTRIDX2"
+_TRAILER = struct.Struct("<QQQQ8s")
+_DOUBLE = struct.Struct("<d")
+
+
+def encode_varint(n, out):
+    """Append the unsigned LEB128 encoding of n to the bytearray out."""
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varint(buf, pos):
+    """Decode an unsigned varint from buf at pos.  Returns (value, new_pos)."""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_blocks(blocks, out):
+    """Append a block count to out: doubled as a varint if it is a whole
+    number, otherwise a 1 followed by the double."""
+    if blocks == int(blocks):
+        encode_varint(int(blocks) << 1, out)
+    else:
+        encode_varint(1, out)
+        out.extend(_DOUBLE.pack(blocks))
+
+
+def decode_blocks(buf, pos):
+    """Decode a block count written by encode_blocks.  Returns (value, new_pos)."""
+    v, pos = decode_varint(buf, pos)
+    if v & 1:
+        return _DOUBLE.unpack_from(buf, pos)[0], pos + _DOUBLE.size
+    return v >> 1, pos
+
+
+def decode_record(buf, pos):
+    """Decode one (round, from, to, piece, blocks) record at pos.
+    Returns (record, new_pos)."""
+    rec = []
+    for i in range(4):
+        v, pos = decode_varint(buf, pos)
+        rec.append(v)
+    v, pos = decode_blocks(buf, pos)
+    rec.append(v)
+    return tuple(rec), pos
+
+
+def decode_records(buf, start, end):
+    """Yield (round, from, to, piece, blocks) tuples encoded in buf[start:end]."""
+    pos = start
+    while pos < end:
+        rec, pos = decode_record(buf, pos)
+        yield rec
+
+
+class TraceWriter:
+    """Streams a History to a trace file, one round at a time."""
+    def __init__(self, path, peer_ids, upload_rates):
+        self.path = path
+        self.peer_ids = peer_ids[:]
+        self.upload_rates = upload_rates
+        self.handle = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.done = []  # [(peer handle, round)]
+        # handle -> offsets of the records the peer is in
+        self.peer_records = [array("Q") for pid in peer_ids]
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.offsets = [len(MAGIC)]
+
+    def write_round(self, round, downloads):
+        """downloads: dict peer_id -> [Download or DownloadBatch] for this
+        round."""
+        h = self.handle
+        start = self.offsets[-1]
+        buf = bytearray()
+        for pid in self.peer_ids:
+            for d in downloads[pid]:
+                (f, t) = (h[d.from_id], h[d.to_id])
+                for (piece, blocks) in d.parts():
+                    self.peer_records[f].append(start + len(buf))
+                    self.peer_records[t].append(start + len(buf))
+                    for v in (round, f, t, piece):
+                        encode_varint(v, buf)
+                    encode_blocks(blocks, buf)
+        self.f.write(buf)
+        self.offsets.append(self.offsets[-1] + len(buf))
+
+    def peer_done(self, peer_id, round):
+        self.done.append((self.handle[peer_id], round))
+
+    def close(self, meta=None):
+        """Write the tables, index and trailer.  meta is a JSON-able dict."""
+        buf = bytearray()
+        peer_table = self.offsets[-1]
+        encode_varint(len(self.peer_ids), buf)
+        for pid in self.peer_ids:
+            name = pid.encode("utf-8")
+            encode_varint(len(name), buf)
+            buf.extend(name)
+            encode_varint(self.upload_rates[pid], buf)
+        encode_varint(len(self.done), buf)
+        for (p, r) in self.done:
+            encode_varint(p, buf)
+            encode_varint(r, buf)
+        m = json.dumps(meta or {}).encode("utf-8")
+        encode_varint(len(m), buf)
+        buf.extend(m)
+        index = peer_table + len(buf)
+        self.f.write(buf)
+        self.f.write(struct.pack("<%dQ" % len(self.offsets), *self.offsets))
+
+        peer_index = index + 8 * len(self.offsets)
+        lists = bytearray()
+        starts = []
+        for offsets in self.peer_records:
+            starts.append(len(lists))
+            last = 0
+            for o in offsets:
+                encode_varint(o - last, lists)
+                last = o
+        starts.append(len(lists))
+        base = peer_index + 8 * len(starts)
+        self.f.write(struct.pack("<%dQ" % len(starts), *[base + s for s in starts]))
+        self.f.write(lists)
+        self.f.write(_TRAILER.pack(peer_table, index, len(self.offsets) - 1,
+                                   peer_index, INDEX_MAGIC))
+        self.f.close()
+
+
+class TraceReader:
+    """
+    Memory-mapped view of a trace file.
+
+    peer_ids: list of peer ids, indexed by handle
+    upload_rates: dict peer_id -> up_bw
+    round_done: dict peer_id -> round the peer finished
+    meta: dict stored by the writer
+    num_rounds: number of rounds in the trace
+    index: memoryview of num_rounds + 1 uint64 record offsets
+    peer_index: memoryview of num_peers + 1 uint64 offsets of the peers'
+        record lists
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a trace file" % path)
+        (peer_table, index, num_rounds, peer_index, magic) = _TRAILER.unpack_from(
+            self.buf, len(self.buf) - _TRAILER.size)
+        if magic != INDEX_MAGIC:
+            raise ValueError("%s is truncated" % path)
+        self.num_rounds = num_rounds
+
+        pos = peer_table
+        n, pos = decode_varint(self.buf, pos)
+        self.peer_ids = []
+        self.upload_rates = dict()
+        for i in range(n):
+            length, pos = decode_varint(self.buf, pos)
+            pid = self.buf[pos:pos+length].decode("utf-8")
+            pos += length
+            self.upload_rates[pid], pos = decode_varint(self.buf, pos)
+            self.peer_ids.append(pid)
+        n, pos = decode_varint(self.buf, pos)
+        self.round_done = dict()
+        for i in range(n):
+            p, pos = decode_varint(self.buf, pos)
+            r, pos = decode_varint(self.buf, pos)
+            self.round_done[self.peer_ids[p]] = r
+        length, pos = decode_varint(self.buf, pos)
+        self.meta = json.loads(self.buf[pos:pos+length].decode("utf-8"))
+
+        self._view = memoryview(self.buf)
+        self.index = self._uint64s(index, num_rounds + 1)
+        self.peer_index = self._uint64s(peer_index, len(self.peer_ids) + 1)
+
+    def _uint64s(self, pos, count):
+        view = self._view[pos:pos + 8 * count]
+        if sys.byteorder != "little":
+            # No zero-copy view possible; fall back to a swapped copy.
+            return list(struct.unpack("<%dQ" % count, view))
+        return view.cast("Q")
+
+    def records(self, first=0, last=None):
+        """Yield (round, from, to, piece, blocks) handle tuples for rounds
+        first..last inclusive (default: all)."""
+        if last is None:
+            last = self.num_rounds - 1
+        if first > last:
+            return iter(())
+        return decode_records(self.buf, self.index[first], self.index[last+1])
+
+    def round(self, r):
+        """The Downloads of round r."""
+        ids = self.peer_ids
+        return [Download(ids[f], ids[t], piece, blocks)
+                for (_, f, t, piece, blocks) in self.records(r, r)]
+
+    def peer_records(self, h):
+        """Yield the (round, from, to, piece, blocks) records peer handle h
+        is in, in file order.  Only those records are decoded."""
+        buf = self.buf
+        pos = self.peer_index[h]
+        end = self.peer_index[h + 1]
+        offset = 0
+        while pos < end:
+            delta, pos = decode_varint(buf, pos)
+            offset += delta
+            yield decode_record(buf, offset)[0]
+
+    def peer(self, peer_id):
+        """dict with the 'downloads' (to) and 'uploads' (from) peer_id: one
+        list of Downloads per round."""
+        h = self.peer_ids.index(peer_id)
+        ids = self.peer_ids
+        downloads = [[] for r in range(self.num_rounds)]
+        uploads = [[] for r in range(self.num_rounds)]
+        for (r, f, t, piece, blocks) in self.peer_records(h):
+            d = Download(ids[f], ids[t], piece, blocks)
+            (downloads if t == h else uploads)[r].append(d)
+        return dict(downloads=downloads, uploads=uploads)
+
+    def close(self):
+        for v in (self.index, self.peer_index):
+            if isinstance(v, memoryview):
+                v.release()
+        self._view.release()
+        self.buf.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+from util import RunningStat
+
+
 class Stats:
     @staticmethod
     def uploaded_blocks(peer_ids, history):
@@ -8,14 +11,16 @@ class Stats:
         history: a History object
         Returns:
         dict: peer_id -> total upload blocks used
+
+        The totals are kept up to date by History.update().
         """
-        uploaded = dict((peer_id, 0) for peer_id in peer_ids)
-        for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
-                
-        return uploaded
+        return dict((peer_id, history.uploaded_blocks[peer_id])
+                    for peer_id in peer_ids)
+
+    @staticmethod
+    def round_throughput(history):
+        """Returns list: round -> blocks transferred in the whole swarm"""
+        return history.round_blocks[:]
 
     @staticmethod
     def uploaded_blocks_str(peer_ids, history):
@@ -26,6 +31,14 @@ class Stats:
         return "\n".join("%s: %d, bw=%d" % (id, d[id], history.upload_rates[id])
                          for id in sorted(list(d.keys()), key=d.__getitem__))
 
+    @staticmethod
+    def wasted_blocks_str(peer_ids, history):
+        """ Blocks of upload bandwidth wasted by each peer as the uploader
+        and as the requester, worst uploaders first """
+        w = history.wasted_from
+        return "\n".join("%s: %s, %s" % (id, w[id], history.wasted_to[id])
+                         for id in sorted(peer_ids, key=lambda id: -w[id]))
+
     @staticmethod
     def completion_rounds(peer_ids, history):
         """Returns dict: peer_id -> round when completed,
@@ -52,4 +65,101 @@ class Stats:
         if None in list(d.values()):
             return None
         return max(d.values())
+
+
+class RunSummary:
+    """
+    Per-peer stats folded over any number of iterations, one History at a
+    time, so the histories themselves don't have to be kept.
+
+    uploaded: dict peer_id -> RunningStat of uploaded blocks
+    completion: dict peer_id -> RunningStat of completion rounds, or None
+        once the peer failed to complete in some iteration
+    class_uploaded, class_completion: the same, keyed by agent class, over
+        the per-iteration mean of that class's peers
+    end_reasons: dict History.end_reason -> number of iterations
+    wasted: RunningStat of the upload blocks wasted in the swarm per
+        iteration (see History.wasted_from)
+    histories: list of the Histories if they were kept, otherwise None
+    """
+    def __init__(self, peer_ids, peer_classes, keep_histories=False):
+        """peer_classes: agent class name of each peer, in peer_ids order"""
+        self.peer_ids = peer_ids[:]
+        self.peer_class = dict(zip(peer_ids, peer_classes))
+        self.classes = list(dict.fromkeys(peer_classes))
+        self.iters = 0
+        self.uploaded = dict((pid, RunningStat()) for pid in peer_ids)
+        self.completion = dict((pid, RunningStat()) for pid in peer_ids)
+        self.class_uploaded = dict((c, RunningStat()) for c in self.classes)
+        self.class_completion = dict((c, RunningStat()) for c in self.classes)
+        self.end_reasons = dict()
+        self.wasted = RunningStat()
+        self.delivered = 0  # blocks transferred, over all iterations
+        self.histories = [] if keep_histories else None
+
+    def add(self, history):
+        self.add_iteration(Stats.uploaded_blocks(self.peer_ids, history),
+                           Stats.completion_rounds(self.peer_ids, history),
+                           history.end_reason, sum(history.round_wasted),
+                           sum(history.round_blocks))
+        if self.histories is not None:
+            self.histories.append(history)
+
+    def add_iteration(self, uploaded, completion, end_reason, wasted=0,
+                      delivered=0):
+        """
+        Fold in one iteration from its results alone, for when the History
+        is elsewhere (see distsweep.py).
+        uploaded: dict peer_id -> uploaded blocks
+        completion: dict peer_id -> completion round, or None
+        wasted, delivered: blocks wasted and transferred in the swarm
+        """
+        self.iters += 1
+        self.end_reasons[end_reason] = self.end_reasons.get(end_reason, 0) + 1
+        self.wasted.add(wasted)
+        self.delivered += delivered
+        for pid in self.peer_ids:
+            self.uploaded[pid].add(uploaded[pid])
+            if completion[pid] is None:
+                self.completion[pid] = None
+            elif self.completion[pid] is not None:
+                self.completion[pid].add(completion[pid])
+
+        for c in self.classes:
+            pids = [pid for pid in self.peer_ids if self.peer_class[pid] == c]
+            self.class_uploaded[c].add(
+                sum(uploaded[pid] for pid in pids) / float(len(pids)))
+            cs = [completion[pid] for pid in pids]
+            if None in cs:
+                self.class_completion[c] = None
+            elif self.class_completion[c] is not None:
+                self.class_completion[c].add(sum(cs) / float(len(cs)))
+
+    def wasted_fraction(self):
+        """Wasted blocks over all the upload bandwidth used, wasted or not."""
+        wasted = self.wasted.mean() * self.iters
+        total = wasted + self.delivered
+        return wasted / total if total > 0 else 0.0
+
+    def completion_mean(self, peer_id):
+        """Mean completion round, or None if the peer didn't always finish."""
+        c = self.completion[peer_id]
+        return None if c is None else c.mean()
+
+    def completion_stddev(self, peer_id):
+        c = self.completion[peer_id]
+        return None if c is None else c.stddev()
+
+    def settled(self, target):
+        """True when the 95% confidence interval of every class's mean
+        uploaded blocks and completion round is within +/- target (a
+        fraction) of the mean.  Classes that didn't always complete can't
+        get a completion estimate, and are only judged on uploads."""
+        stats = list(self.class_uploaded.values())
+        stats.extend(c for c in self.class_completion.values() if c is not None)
+        for s in stats:
+            hw = s.ci95()
+            if hw is None or hw > target * abs(s.mean()):
+                return False
+        return True
     
\ No newline at end of file
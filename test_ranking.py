@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from messages import Download
+from ranking import ScoreHeap, ReciprocationTracker, RequesterRanking
+
+
+class TestScoreHeap(unittest.TestCase):
+    def check(self, heap, scores):
+        self.assertEqual(len(heap), len(scores))
+        self.assertEqual(sorted(heap.keys()), sorted(scores))
+        top = list(heap.iter_top())
+        self.assertEqual(sorted(top), sorted(scores.items()))
+        self.assertEqual([s for (k, s) in top],
+                         sorted(scores.values(), reverse=True))
+        if scores:
+            self.assertEqual(heap.top()[1], max(scores.values()))
+
+    def test_matches_sorting(self):
+        rng = random.Random(3)
+        heap = ScoreHeap()
+        scores = dict()
+        for step in range(2000):
+            op = rng.random()
+            key = rng.randrange(40)
+            if op < 0.6:
+                score = rng.choice([rng.randrange(10), rng.random()])
+                heap.set(key, score)
+                scores[key] = score
+            elif key in scores:
+                heap.remove(key)
+                del scores[key]
+            self.assertEqual(key in heap, key in scores)
+            if step % 50 == 0:
+                self.check(heap, scores)
+        self.check(heap, scores)
+
+    def test_iter_top_stops_early(self):
+        heap = ScoreHeap()
+        for k in range(100):
+            heap.set(k, k % 7)
+        first = []
+        for (k, s) in heap.iter_top():
+            first.append(s)
+            if len(first) == 5:
+                break
+        self.assertEqual(first, [6] * 5)
+        self.assertEqual(len(heap), 100)
+
+    def test_score(self):
+        heap = ScoreHeap()
+        heap.set("a", 1)
+        heap.set("a", 5)
+        heap.set("b", 3)
+        self.assertEqual(heap.score("a"), 5)
+        self.assertEqual(heap.top(), ("a", 5))
+
+
+class TestReciprocationTracker(unittest.TestCase):
+    def test_streaks(self):
+        dl = lambda f: Download(f, "me", 0, 1)
+        downloads = [[dl("a")], [dl("a"), dl("b"), dl("a")], [], [dl("b")],
+                     [dl("a"), dl("b")]]
+        t = ReciprocationTracker()
+        t.update(downloads[:2])
+        self.assertEqual((t.streak("a"), t.streak("b"), t.streak("c")), (2, 1, 0))
+        t.update(downloads[:3])
+        self.assertEqual((t.streak("a"), t.streak("b")), (0, 0))
+        t.update(downloads)
+        self.assertEqual((t.streak("a"), t.streak("b")), (1, 2))
+
+
+class TestRequesterRanking(unittest.TestCase):
+    def test_matches_stable_sort(self):
+        rng = random.Random(5)
+        scores = dict()
+        ranking = RequesterRanking(lambda p: scores[p])
+        peers = list(range(30))
+        for round in range(300):
+            changed = rng.sample(peers, rng.randrange(10))
+            for p in changed:
+                scores[p] = rng.randrange(5)
+            for p in peers:
+                scores.setdefault(p, rng.randrange(5))
+            ranking.rescore(changed)
+            requesting = [rng.choice(peers) for i in range(rng.randrange(20))]
+            want = sorted(requesting, key=lambda p: scores[p], reverse=True)
+            self.assertEqual(list(ranking.ranked(requesting)), want)
+
+    def test_stopped_early(self):
+        scores = {"a": 1, "b": 3, "c": 2}
+        ranking = RequesterRanking(scores.get)
+        it = ranking.ranked(["a", "b", "c"])
+        self.assertEqual(next(it), "b")
+        # The next round works from the same heap
+        scores["a"] = 4
+        ranking.rescore(["a"])
+        self.assertEqual(list(ranking.ranked(["a", "c"])), ["a", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
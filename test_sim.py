@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+import unittest
+
+from messages import Request, Upload
+from peer import Peer
+from sim import Sim, make_parser, make_config
+
+
+class SeedSlow(Peer):
+    """Sends 4 blocks to the first requester and 4 to Idle0, whether it
+    asked or not."""
+    def requests(self, peers, history):
+        return []
+
+    def uploads(self, requests, peers, history):
+        ups = [Upload(self.id, "Idle0", 4)]
+        requesters = sorted(set(r.requester_id for r in requests))
+        if requesters:
+            ups.append(Upload(self.id, requesters[0], 4))
+        return ups
+
+
+class Relay(Peer):
+    """Asks every neighbor for each piece it still needs, and gives all
+    its bandwidth to the first requester."""
+    def requests(self, peers, history):
+        needed = [i for i in range(len(self.pieces))
+                  if self.pieces[i] < self.conf.blocks_per_piece]
+        return [Request(self.id, p.id, i, self.pieces[i])
+                for p in sorted(peers, key=lambda p: p.id)
+                for i in needed if i in p.available_pieces]
+
+    def uploads(self, requests, peers, history):
+        requesters = sorted(set(r.requester_id for r in requests))
+        if not requesters:
+            return []
+        return [Upload(self.id, requesters[0], self.up_bw)]
+
+
+class Idle(Peer):
+    def requests(self, peers, history):
+        return []
+
+    def uploads(self, requests, peers, history):
+        return []
+
+
+def run(*args):
+    (options, _) = make_parser().parse_args(
+        ["--num-pieces=2", "--blocks-per-piece=4", "--min-bw=8",
+         "--max-bw=8", "--max-round=2", "--loglevel=warning"] + list(args))
+    config = make_config(options, ["Seed"])
+    config.agent_class_names = ["SeedSlow", "Relay", "Relay", "Idle"]
+    config.agent_classes = {"SeedSlow": SeedSlow, "Relay": Relay, "Idle": Idle}
+    return Sim(config).run_sim_once()
+
+
+def key(downloads):
+    return [(d.from_id, d.piece, d.blocks) for d in downloads]
+
+
+class TestReclaim(unittest.TestCase):
+    def test_no_relay_in_same_round(self):
+        # Round 1: SeedSlow0 finishes Relay0's piece 1, then Relay0's
+        # leftover bandwidth to Relay1 must not pass that piece on.
+        for args in [[], ["--reclaim"]]:
+            h = run(*args)
+            self.assertEqual(key(h.downloads["Relay0"][1]),
+                             [("SeedSlow0", 1, 4)])
+            self.assertEqual(key(h.downloads["Relay1"][1]),
+                             [("Relay0", 0, 4)])
+            self.assertEqual(key(h.downloads["Relay1"][2]),
+                             [("Relay0", 1, 4)])
+
+    def test_unrequested_uploads_wasted(self):
+        for args in [[], ["--reclaim"]]:
+            h = run(*args)
+            self.assertEqual(h.wasted_to["Idle0"], 4 * 3)
+            self.assertEqual(h.round_wasted[0], 4)
+            # Relay0's leftover 4 blocks in round 1
+            self.assertEqual(h.round_wasted[1], 4 + 4)
+            # Relay0's extra 4 blocks and all of SeedSlow0's piece 1
+            self.assertEqual(h.round_wasted[2], 4 + 4 + 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
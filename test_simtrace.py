@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from messages import Download, DownloadBatch
+from simtrace import (encode_varint, decode_varint, encode_blocks,
+                      decode_blocks, TraceWriter, TraceReader)
+
+
+class TestEncoding(unittest.TestCase):
+    def test_varint_round_trip(self):
+        values = [0, 1, 127, 128, 255, 300, 16383, 16384, 2**32, 2**63 - 1]
+        buf = bytearray()
+        for v in values:
+            encode_varint(v, buf)
+        pos = 0
+        for v in values:
+            (got, pos) = decode_varint(buf, pos)
+            self.assertEqual(got, v)
+        self.assertEqual(pos, len(buf))
+
+    def test_varint_sizes(self):
+        for (v, size) in [(0, 1), (127, 1), (128, 2), (16383, 2), (16384, 3)]:
+            buf = bytearray()
+            encode_varint(v, buf)
+            self.assertEqual(len(buf), size)
+
+    def test_blocks_round_trip(self):
+        values = [0, 1, 4, 1000, 2.0, 0.5, 2.25, 1e-9, 3.7]
+        buf = bytearray()
+        for v in values:
+            encode_blocks(v, buf)
+        pos = 0
+        for v in values:
+            (got, pos) = decode_blocks(buf, pos)
+            self.assertEqual(got, v)
+        self.assertEqual(pos, len(buf))
+
+    def test_whole_blocks_decode_as_ints(self):
+        buf = bytearray()
+        encode_blocks(3.0, buf)
+        (got, pos) = decode_blocks(buf, 0)
+        self.assertEqual(got, 3)
+        self.assertIsInstance(got, int)
+
+
+class TestTraceFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.trace")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, rounds, done=(), meta=None):
+        ids = ["Seed0", "A0", "B0"]
+        rates = {"Seed0": 10, "A0": 4, "B0": 300}
+        w = TraceWriter(self.path, ids, rates)
+        for (r, downloads) in enumerate(rounds):
+            w.write_round(r, downloads)
+        for (pid, r) in done:
+            w.peer_done(pid, r)
+        w.close(meta)
+        return (ids, rates)
+
+    def rounds(self):
+        batch = DownloadBatch("Seed0", "B0")
+        batch.add(3, 2)
+        batch.add(200, 1.5)
+        return [
+            {"Seed0": [], "A0": [Download("Seed0", "A0", 0, 4)], "B0": []},
+            {"Seed0": [], "A0": [], "B0": []},
+            {"Seed0": [], "A0": [Download("B0", "A0", 1, 0.25)],
+             "B0": [batch, Download("A0", "B0", 0, 4)]},
+        ]
+
+    def test_round_trip(self):
+        (ids, rates) = self.write(self.rounds(), [("A0", 2)], {"end_reason": "done"})
+        with TraceReader(self.path) as t:
+            self.assertEqual(t.peer_ids, ids)
+            self.assertEqual(t.upload_rates, rates)
+            self.assertEqual(t.round_done, {"A0": 2})
+            self.assertEqual(t.meta, {"end_reason": "done"})
+            self.assertEqual(t.num_rounds, 3)
+            self.assertEqual(list(t.records()), [
+                (0, 0, 1, 0, 4),
+                (2, 2, 1, 1, 0.25),
+                (2, 0, 2, 3, 2), (2, 0, 2, 200, 1.5), (2, 1, 2, 0, 4)])
+            self.assertEqual(list(t.records(1, 1)), [])
+            self.assertEqual([(d.from_id, d.to_id, d.piece, d.blocks) for d in t.round(0)],
+                             [("Seed0", "A0", 0, 4)])
+
+    def test_peer(self):
+        self.write(self.rounds())
+        key = lambda ds: [[(d.from_id, d.to_id, d.piece, d.blocks) for d in r]
+                          for r in ds]
+        with TraceReader(self.path) as t:
+            a = t.peer("A0")
+            self.assertEqual(key(a["downloads"]), [
+                [("Seed0", "A0", 0, 4)], [], [("B0", "A0", 1, 0.25)]])
+            self.assertEqual(key(a["uploads"]), [[], [], [("A0", "B0", 0, 4)]])
+            seed = t.peer("Seed0")
+            self.assertEqual(key(seed["downloads"]), [[], [], []])
+            self.assertEqual(key(seed["uploads"]), [
+                [("Seed0", "A0", 0, 4)], [],
+                [("Seed0", "B0", 3, 2), ("Seed0", "B0", 200, 1.5)]])
+
+    def test_peer_matches_records(self):
+        rng = random.Random(1)
+        ids = ["P%d" % i for i in range(6)]
+        rounds = []
+        for r in range(20):
+            downloads = dict((pid, []) for pid in ids)
+            for i in range(rng.randrange(15)):
+                (f, t) = rng.sample(ids, 2)
+                downloads[t].append(Download(f, t, rng.randrange(1000),
+                                             rng.choice([1, 4, 0.5])))
+            rounds.append(downloads)
+        w = TraceWriter(self.path, ids, dict((pid, 1) for pid in ids))
+        for (r, downloads) in enumerate(rounds):
+            w.write_round(r, downloads)
+        w.close()
+        with TraceReader(self.path) as t:
+            records = list(t.records())
+            for (h, pid) in enumerate(ids):
+                p = t.peer(pid)
+                got = sorted((r, ids.index(d.from_id), ids.index(d.to_id), d.piece, d.blocks)
+                             for (r, ds) in enumerate(p["downloads"]) for d in ds)
+                got += sorted((r, ids.index(d.from_id), ids.index(d.to_id), d.piece, d.blocks)
+                              for (r, ds) in enumerate(p["uploads"]) for d in ds)
+                want = sorted(rec for rec in records if rec[2] == h)
+                want += sorted(rec for rec in records if rec[1] == h)
+                self.assertEqual(got, want)
+
+    def test_not_a_trace(self):
+        with open(self.path, "wb") as f:
+            f.write(b"something else entirely" * 4)
+        self.assertRaises(ValueError, TraceReader, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
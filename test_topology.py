@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from topology import FullTopology, RandomRegularTopology, TrackerTopology
+
+
+class TopologyChecks:
+    def check_graph(self, t, n):
+        for h in range(n):
+            ns = t.neighbors_of(h)
+            self.assertEqual(ns, sorted(ns))
+            self.assertNotIn(h, ns)
+            self.assertEqual(len(ns), t.degree(h))
+            for q in ns:
+                self.assertTrue(t.is_neighbor(h, q))
+                self.assertTrue(t.is_neighbor(q, h))
+            for q in set(range(n)) - set(ns):
+                self.assertFalse(t.is_neighbor(h, q))
+
+
+class TestFullTopology(unittest.TestCase, TopologyChecks):
+    def test_everyone(self):
+        t = FullTopology(5)
+        self.assertTrue(t.refresh(0))
+        self.assertFalse(t.refresh(1))
+        self.check_graph(t, 5)
+        self.assertEqual(t.neighbors_of(2), [0, 1, 3, 4])
+
+
+class TestRandomRegularTopology(unittest.TestCase, TopologyChecks):
+    def test_regular(self):
+        for (n, degree, seed) in [(10, 3, 1), (50, 6, 2), (101, 10, 3), (11, 3, 8)]:
+            t = RandomRegularTopology(n, degree, random.Random(seed))
+            self.check_graph(t, n)
+            degrees = [t.degree(h) for h in range(n)]
+            self.assertTrue(max(degrees) <= degree)
+            # Self-loops and duplicate edges get fixed
+            self.assertEqual(sum(degrees), n * degree - (n * degree) % 2)
+
+    def test_degree_capped_by_size(self):
+        t = RandomRegularTopology(4, 10, random.Random(1))
+        self.assertTrue(all(t.degree(h) <= 3 for h in range(4)))
+
+
+class TestTrackerTopology(unittest.TestCase, TopologyChecks):
+    def test_bounded_degree(self):
+        for (n, degree, seed) in [(20, 3, 1), (200, 10, 2), (30, 29, 3)]:
+            t = TrackerTopology(n, degree, 5, random.Random(seed))
+            for round in range(0, 20, 5):
+                self.assertTrue(t.refresh(round))
+                self.check_graph(t, n)
+                self.assertTrue(max(t.degree(h) for h in range(n)) <= degree)
+                mean = sum(t.degree(h) for h in range(n)) / float(n)
+                self.assertTrue(mean > 0.8 * degree)
+
+    def test_refresh(self):
+        t = TrackerTopology(30, 4, 3, random.Random(7))
+        self.assertTrue(t.refresh(0))
+        first = [t.neighbors_of(h) for h in range(30)]
+        self.assertFalse(t.refresh(1))
+        self.assertFalse(t.refresh(2))
+        self.assertEqual([t.neighbors_of(h) for h in range(30)], first)
+        self.assertTrue(t.refresh(3))
+        self.assertNotEqual([t.neighbors_of(h) for h in range(30)], first)
+
+    def test_same_seed_same_graph(self):
+        graphs = []
+        for i in range(2):
+            t = TrackerTopology(40, 5, 1, random.Random(11))
+            t.refresh(0)
+            graphs.append([t.neighbors_of(h) for h in range(40)])
+        self.assertEqual(graphs[0], graphs[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
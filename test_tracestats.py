@@ -0,0 +1,42 @@
+#!/usr/bin/python
+
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+
+import tracestats
+from sim import Sim, make_parser, make_config, log_summary
+
+
+class TestMatchesSim(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_same_summary(self):
+        (options, _) = make_parser().parse_args(
+            ["--num-pieces=8", "--iters=4", "--seed=3", "--loglevel=warning",
+             "--trace-dir=%s" % self.dir])
+        config = make_config(options, ["TodoketeStd"] * 3 + ["Seed"])
+        summary = Sim(config).run_sim()
+        with self.assertLogs(level="WARNING") as logs:
+            log_summary(summary)
+        want = [r.getMessage() for r in logs.records]
+        want = want[want.index("Uploaded blocks: avg (stddev)"):]
+        want = want[:[l.startswith("Wasted") for l in want].index(True)]
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            tracestats.main(["tracestats.py", self.dir])
+        got = out.getvalue().splitlines()
+        self.assertEqual(got[0], "4 traces")
+        self.assertEqual(got[1:1 + len(want)], want)
+        self.assertTrue(got[1 + len(want)].startswith("Fairness"))
+
+
+if __name__ == "__main__":
+    unittest.main()
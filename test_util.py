@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+import math
+import random
+import unittest
+
+from util import RunningStat, t95, mean
+
+
+class TestRunningStat(unittest.TestCase):
+    def test_matches_two_pass(self):
+        rng = random.Random(2)
+        for n in [1, 2, 3, 10, 1000]:
+            xs = [rng.gauss(50, 7) for i in range(n)]
+            s = RunningStat()
+            for x in xs:
+                s.add(x)
+            m = mean(xs)
+            self.assertEqual(s.n, n)
+            self.assertAlmostEqual(s.mean(), m)
+            pop_var = sum((x - m) ** 2 for x in xs) / n
+            self.assertAlmostEqual(s.stddev(), math.sqrt(pop_var))
+
+    def test_large_offset(self):
+        # The naive sum-of-squares formula loses everything here
+        s = RunningStat()
+        for x in [1e9 + 4, 1e9 + 7, 1e9 + 13, 1e9 + 16]:
+            s.add(x)
+        self.assertAlmostEqual(s.mean(), 1e9 + 10)
+        self.assertAlmostEqual(s.stddev(), math.sqrt(22.5))
+
+    def test_empty(self):
+        s = RunningStat()
+        self.assertRaises(ZeroDivisionError, s.mean)
+        self.assertEqual(s.stddev(), 0)
+        self.assertIsNone(s.ci95())
+
+    def test_ci95(self):
+        s = RunningStat()
+        s.add(3)
+        self.assertIsNone(s.ci95())
+        for x in [5, 7, 9]:
+            s.add(x)
+        # sample sd of 3, 5, 7, 9 is sqrt(20 / 3)
+        self.assertAlmostEqual(s.ci95(), 3.182 * math.sqrt(20 / 3.0 / 4))
+
+
+class TestT95(unittest.TestCase):
+    def test_values(self):
+        # Exact quantiles, also past the table
+        for (df, t) in [(1, 12.706), (10, 2.228), (30, 2.042), (40, 2.021),
+                        (60, 2.000), (120, 1.980), (10**6, 1.960)]:
+            self.assertAlmostEqual(t95(df), t, places=3)
+
+    def test_decreasing(self):
+        ts = [t95(df) for df in range(1, 500)]
+        self.assertTrue(all(a > b for (a, b) in zip(ts, ts[1:])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,14 +4,14 @@ import random
 import logging
 import math
 
-from messages import Upload, Request
+from messages import Upload, RangeRequest
 from util import even_split
 from peer import Peer
 from collections import defaultdict
 
 class TodoketePropShare(Peer):
     def post_init(self):
-        print(("post_init(): %s here!" % self.id))
+        logging.info("post_init(): %s here!" % self.id)
         self.optimistic_unchoke = None
     
     def requests(self, peers, history):
@@ -19,7 +19,7 @@ class TodoketePropShare(Peer):
         peers: available info about the peers (who has what pieces)
         history: what's happened so far as far as this peer can see
 
-        returns: a list of Request() objects
+        returns: a list of RangeRequest() objects, one per peer
 
         This will be called after update_pieces() with the most recent state.
         """
@@ -33,8 +33,12 @@ class TodoketePropShare(Peer):
         random.shuffle(peers)
 
         # Determine rarity of each piece (e.g. how many peers own each piece)
+        # Peers with every piece add the same count to every piece, which
+        # doesn't change the order, so they are skipped.
         rarity = defaultdict(int)
         for peer in peers:
+            if peer.complete:
+                continue
             for piece_id in peer.available_pieces:
                 rarity[piece_id] += 1
 
@@ -42,8 +46,7 @@ class TodoketePropShare(Peer):
         # (up to self.max_requests from each)
         random.shuffle(peers)
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            isect = peer.available_pieces.intersection(np_set)
             isect = list(isect)
             
             n = min(self.max_requests, len(isect))
@@ -54,13 +57,12 @@ class TodoketePropShare(Peer):
                 random.shuffle(isect)
                 isect.sort(key = lambda x: rarity[x])
                 isect = isect[:n]
-            for piece_id in isect:
-                # aha! The peer has this piece! Request it.
-                # which part of the piece do we need next?
-                # (must get the next-needed blocks in order)
-                start_block = self.pieces[piece_id]
-                r = Request(self.id, peer.id, piece_id, start_block)
-                requests.append(r)
+            if len(isect) > 0:
+                # aha! The peer has these pieces! Request them all in one
+                # message, starting from the next-needed block of each
+                # (must get the blocks in order)
+                pieces = [(piece_id, self.pieces[piece_id]) for piece_id in isect]
+                requests.append(RangeRequest(self.id, peer.id, pieces))
 
         return requests
 
@@ -84,7 +86,9 @@ class TodoketePropShare(Peer):
             chosen = []
 
             # List of peers who have made requests
-            requesting_peers = [request.requester_id for request in requests]
+            # (one entry per piece requested)
+            requesting_peers = [request.requester_id for request in requests
+                                for part in request.parts()]
 
             # Every round except the first, determine which requesting peers uploaded to us
             if current_round > 0:
@@ -3,13 +3,14 @@
 import random
 import logging
 
-from messages import Upload, Request
+from messages import Upload, RangeRequest
 from peer import Peer
+from ranking import RequesterRanking, ReciprocationTracker
 from collections import defaultdict
 
 class TodoketeTyrant(Peer):
     def post_init(self):
-        print(("post_init(): %s here!" % self.id))
+        logging.info("post_init(): %s here!" % self.id)
         self.alpha = 0.10
         self.r = 4
         self.gamma = 0.07
@@ -17,13 +18,18 @@ class TodoketeTyrant(Peer):
         self.uinit = 25
         self.dlr_ests = defaultdict(lambda: self.dinit)
         self.ulr_ests = defaultdict(lambda: self.uinit)
+        # Requesters by decreasing dlr/ulr, and how long each peer has
+        # been unchoking us
+        self.ranking = RequesterRanking(
+            lambda peer: self.dlr_ests[peer]/self.ulr_ests[peer])
+        self.reciprocated = ReciprocationTracker()
     
     def requests(self, peers, history):
         """
         peers: available info about the peers (who has what pieces)
         history: what's happened so far as far as this peer can see
 
-        returns: a list of Request() objects
+        returns: a list of RangeRequest() objects, one per peer
 
         This will be called after update_pieces() with the most recent state.
         """
@@ -37,8 +43,12 @@ class TodoketeTyrant(Peer):
         random.shuffle(peers)
 
         # Determine rarity of each piece (e.g. how many peers own each piece)
+        # Peers with every piece add the same count to every piece, which
+        # doesn't change the order, so they are skipped.
         rarity = defaultdict(int)
         for peer in peers:
+            if peer.complete:
+                continue
             for piece_id in peer.available_pieces:
                 rarity[piece_id] += 1
 
@@ -46,8 +56,7 @@ class TodoketeTyrant(Peer):
         # (up to self.max_requests from each)
         random.shuffle(peers)
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            isect = peer.available_pieces.intersection(np_set)
             isect = list(isect)
             
             n = min(self.max_requests, len(isect))
@@ -58,13 +67,12 @@ class TodoketeTyrant(Peer):
                 random.shuffle(isect)
                 isect.sort(key = lambda x: rarity[x])
                 isect = isect[:n]
-            for piece_id in isect:
-                # aha! The peer has this piece! Request it.
-                # which part of the piece do we need next?
-                # (must get the next-needed blocks in order)
-                start_block = self.pieces[piece_id]
-                r = Request(self.id, peer.id, piece_id, start_block)
-                requests.append(r)
+            if len(isect) > 0:
+                # aha! The peer has these pieces! Request them all in one
+                # message, starting from the next-needed block of each
+                # (must get the blocks in order)
+                pieces = [(piece_id, self.pieces[piece_id]) for piece_id in isect]
+                requests.append(RangeRequest(self.id, peer.id, pieces))
 
         return requests
 
@@ -88,7 +96,9 @@ class TodoketeTyrant(Peer):
         else:
             
             # List of peers who have made requests
-            requesting_peers = [request.requester_id for request in requests]
+            # (one entry per piece requested)
+            requesting_peers = [request.requester_id for request in requests
+                                for part in request.parts()]
 
             if current_round > 0:
                 # Update download rate estimates for peers
@@ -98,6 +108,7 @@ class TodoketeTyrant(Peer):
                     dlr_updates[dl.from_id] += 1
                 for pid, update in dlr_updates.items():
                     self.dlr_ests[pid] = update
+                self.reciprocated.update(history.downloads)
 
                 # Update upload rate estimates for peers
                 prev_uls = history.uploads[current_round-1]
@@ -109,20 +120,14 @@ class TodoketeTyrant(Peer):
                     if peer not in dlr_updates.keys():
                         self.ulr_ests[peer] = (1 + self.alpha) * self.ulr_ests[peer]
                     # If peer unchoked us for last r rounds, decrease ulr
-                    elif current_round >= self.r:
-                        for prev_round in history.downloads[current_round-self.r+1:current_round]:
-                            last_r = False
-                            for dl in prev_round:
-                                if dl.from_id == peer:
-                                    last_r = True
-                                    break
-                            if not last_r:
-                                break
-                        if last_r:
-                            self.ulr_ests[peer] = (1 - self.gamma) * self.ulr_ests[peer]
+                    elif (current_round >= self.r and
+                          self.reciprocated.streak(peer) >= self.r - 1):
+                        self.ulr_ests[peer] = (1 - self.gamma) * self.ulr_ests[peer]
+                self.ranking.rescore(dlr_updates)
+                self.ranking.rescore(prev_unchoked)
                     
-            # Sort requesting peers by decreasing dlr/ulr
-            requesting_peers = sorted(requesting_peers, key=lambda peer: self.dlr_ests[peer]/self.ulr_ests[peer], reverse=True)
+            # Go through requesting peers by decreasing dlr/ulr
+            requesting_peers = self.ranking.ranked(requesting_peers)
             
             # Add upload slots until cap is reached
             chosen = []
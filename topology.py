@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+"""
+Who can see whom.  Each round a peer is only shown the PeerInfo of its
+neighbors, and may only send requests to them.
+
+  FullTopology           everyone sees everyone (the original behavior)
+  RandomRegularTopology  a fixed random graph where every peer has `degree`
+                         neighbors
+  TrackerTopology        every `refresh` rounds each peer asks the tracker
+                         for random peers; connections go both ways and
+                         no peer gets more than `degree` neighbors
+
+Peers are the simulator's integer handles 0..n-1.  Neighbor lists are
+always in handle order, so agents see peers in the same order as they would
+with the full topology.
+"""
+
+import random
+
+
+class FullTopology:
+    def __init__(self, n):
+        self.n = n
+
+    def refresh(self, round):
+        """Update the graph for this round.  Returns True if it changed."""
+        return round == 0
+
+    def neighbors_of(self, h):
+        return [q for q in range(self.n) if q != h]
+
+    def is_neighbor(self, h, other):
+        return other != h and 0 <= other < self.n
+
+    def degree(self, h):
+        return self.n - 1
+
+
+class _GraphTopology:
+    """Base for topologies with an explicit adjacency list."""
+    def __init__(self, n, rng):
+        self.n = n
+        self.rng = rng
+        self.adj = [set() for h in range(n)]
+        self.lists = []
+
+    def _connect(self, a, b):
+        self.adj[a].add(b)
+        self.adj[b].add(a)
+
+    def _rebuild_lists(self):
+        self.lists = [sorted(a) for a in self.adj]
+
+    def neighbors_of(self, h):
+        return self.lists[h][:]
+
+    def is_neighbor(self, h, other):
+        return other in self.adj[h]
+
+    def degree(self, h):
+        return len(self.adj[h])
+
+
+class RandomRegularTopology(_GraphTopology):
+    """
+    A random `degree`-regular graph, built once by pairing up `degree` stubs
+    per peer at random.  Pairs that would be self-loops or duplicate edges
+    are fixed by swapping endpoints with random existing edges; the few that
+    can't be fixed are dropped, leaving those peers one short.
+    """
+    def __init__(self, n, degree, rng=None):
+        _GraphTopology.__init__(self, n, rng or random.Random())
+        degree = min(degree, n - 1)
+        stubs = [h for h in range(n) for i in range(degree)]
+        self.rng.shuffle(stubs)
+        edges = []
+        bad = []
+        for i in range(0, len(stubs) - 1, 2):
+            (a, b) = (stubs[i], stubs[i+1])
+            if a == b or b in self.adj[a]:
+                bad.append((a, b))
+            else:
+                self._connect(a, b)
+                edges.append((a, b))
+
+        for (a, b) in bad:
+            for attempt in range(100):
+                if not edges:
+                    break
+                j = self.rng.randrange(len(edges))
+                (x, y) = edges[j]
+                # replace x-y by a-x and b-y (for a self-loop, a-x and a-y)
+                if a == b:
+                    ok = a not in (x, y) and x not in self.adj[a] and y not in self.adj[a]
+                else:
+                    ok = (len(set((a, b, x, y))) == 4 and x not in self.adj[a]
+                          and y not in self.adj[b])
+                if ok:
+                    self.adj[x].discard(y)
+                    self.adj[y].discard(x)
+                    self._connect(a, x)
+                    self._connect(b, y)
+                    edges[j] = (a, x)
+                    edges.append((b, y))
+                    break
+        self._rebuild_lists()
+
+    def refresh(self, round):
+        return round == 0
+
+
+class TrackerTopology(_GraphTopology):
+    """
+    Every `refresh` rounds the graph is rebuilt: each peer gets `degree`
+    random peers from the tracker and connects to the ones that still have
+    room, both ways.  The degree is at most `degree`; a peer whose
+    candidates were mostly full already ends up with fewer.
+    """
+    def __init__(self, n, degree, refresh, rng=None):
+        _GraphTopology.__init__(self, n, rng or random.Random())
+        self.degree_wanted = min(degree, n - 1)
+        self.refresh_rounds = max(1, refresh)
+
+    def refresh(self, round):
+        if round % self.refresh_rounds != 0:
+            return False
+        self.adj = [set() for h in range(self.n)]
+        for h in range(self.n):
+            for other in self.rng.sample(range(self.n), self.degree_wanted + 1):
+                if (other != h and len(self.adj[h]) < self.degree_wanted
+                    and len(self.adj[other]) < self.degree_wanted):
+                    self._connect(h, other)
+        self._rebuild_lists()
+        return True
+
+
+def make_topology(conf, n):
+    """Build the topology named by conf.topology for n peers.  Random choices
+    come from their own stream, seeded from the global random state."""
+    if conf.topology == "full":
+        return FullTopology(n)
+    elif conf.topology == "regular":
+        rng = random.Random(random.getrandbits(32))
+        return RandomRegularTopology(n, conf.degree, rng)
+    elif conf.topology == "tracker":
+        rng = random.Random(random.getrandbits(32))
+        return TrackerTopology(n, conf.degree, conf.refresh, rng)
+    raise ValueError("Unknown topology: %s" % conf.topology)
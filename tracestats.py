@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+Offline statistics over saved traces (see simtrace.py).
+
+TraceStats mirrors the Stats API, but works on a memory-mapped TraceReader
+instead of a live History, and adds per-round throughput and fairness.
+Records are decoded straight out of the memory map, one pass per trace, into
+flat arrays indexed by peer handle and by round.
+
+Usage: tracestats.py TRACE_OR_DIR ...
+  Prints the same uploaded blocks and completion rounds summary as sim.py
+  for any number of saved iterations, holding only one trace open at a
+  time.
+"""
+
+import os
+import sys
+from array import array
+
+from simtrace import TraceReader
+from util import RunningStat
+
+
+class TraceSummary:
+    """
+    One decoding pass over a trace.
+
+    uploaded: array, handle -> blocks uploaded
+    downloaded: array, handle -> blocks downloaded
+    round_blocks: array, round -> blocks transferred in the whole swarm
+
+    (Doubles, since block counts can be fractional.)
+    """
+    def __init__(self, trace):
+        n = len(trace.peer_ids)
+        self.uploaded = array("d", bytes(8 * n))
+        self.downloaded = array("d", bytes(8 * n))
+        self.round_blocks = array("d", bytes(8 * trace.num_rounds))
+        for (r, f, t, piece, blocks) in trace.records():
+            self.uploaded[f] += blocks
+            self.downloaded[t] += blocks
+            self.round_blocks[r] += blocks
+
+
+class TraceStats:
+    @staticmethod
+    def summary(trace):
+        """Cache the decoding pass on the trace, so several stats share it."""
+        s = getattr(trace, "_summary", None)
+        if s is None:
+            s = trace._summary = TraceSummary(trace)
+        return s
+
+    @staticmethod
+    def uploaded_blocks(trace):
+        """dict: peer_id -> total upload blocks used"""
+        s = TraceStats.summary(trace)
+        return dict(zip(trace.peer_ids, s.uploaded))
+
+    @staticmethod
+    def completion_rounds(trace):
+        """dict: peer_id -> round when completed, or None if not completed"""
+        return dict((pid, trace.round_done.get(pid)) for pid in trace.peer_ids)
+
+    @staticmethod
+    def all_done_round(trace):
+        d = TraceStats.completion_rounds(trace)
+        if None in list(d.values()):
+            return None
+        return max(d.values())
+
+    @staticmethod
+    def round_throughput(trace):
+        """array: round -> blocks transferred in that round"""
+        return TraceStats.summary(trace).round_blocks
+
+    @staticmethod
+    def share_ratios(trace):
+        """dict: peer_id -> uploaded / downloaded blocks, for the peers that
+        downloaded anything."""
+        s = TraceStats.summary(trace)
+        return dict((pid, s.uploaded[i] / float(s.downloaded[i]))
+                    for (i, pid) in enumerate(trace.peer_ids)
+                    if s.downloaded[i] > 0)
+
+    @staticmethod
+    def fairness(trace):
+        """Jain's fairness index of the share ratios: 1.0 when every peer
+        gives back exactly in proportion to what it gets, 1/n at worst.
+        None if nobody downloaded anything."""
+        xs = list(TraceStats.share_ratios(trace).values())
+        if len(xs) == 0:
+            return None
+        sq = sum(x * x for x in xs)
+        if sq == 0:
+            return None
+        return sum(xs) ** 2 / (len(xs) * sq)
+
+
+def trace_paths(args):
+    """Expand directories into the trace files they contain."""
+    paths = []
+    for a in args:
+        if os.path.isdir(a):
+            paths.extend(os.path.join(a, f) for f in sorted(os.listdir(a))
+                         if f.endswith(".trace"))
+        else:
+            paths.append(a)
+    return paths
+
+
+def aggregate(paths):
+    """
+    Fold the stats of many traces into RunningStats, as stats.RunSummary
+    does: dicts peer_id -> RunningStat of uploaded blocks and of completion
+    rounds (None once the peer failed to complete in some trace), and a
+    RunningStat of the fairness.  Only one trace is mapped at a time.
+    """
+    uploaded_by_id = dict()
+    completion_by_id = dict()
+    fairness = RunningStat()
+    for path in paths:
+        with TraceReader(path) as t:
+            for (pid, u) in TraceStats.uploaded_blocks(t).items():
+                uploaded_by_id.setdefault(pid, RunningStat()).add(u)
+            for (pid, c) in TraceStats.completion_rounds(t).items():
+                stat = completion_by_id.setdefault(pid, RunningStat())
+                if c is None:
+                    completion_by_id[pid] = None
+                elif stat is not None:
+                    stat.add(c)
+            f = TraceStats.fairness(t)
+            if f is not None:
+                fairness.add(f)
+    return uploaded_by_id, completion_by_id, fairness
+
+
+def main(args):
+    paths = trace_paths(args[1:])
+    if len(paths) == 0:
+        print("Usage: tracestats.py TRACE_OR_DIR ...")
+        sys.exit(1)
+
+    uploaded_by_id, completion_by_id, fairness = aggregate(paths)
+    print("%d traces" % len(paths))
+    print("Uploaded blocks: avg (stddev)")
+    for p_id in sorted(uploaded_by_id, key=lambda id: uploaded_by_id[id].mean()):
+        us = uploaded_by_id[p_id]
+        print("%s: %.1f  (%.1f)" % (p_id, us.mean(), us.stddev()))
+
+    print("Completion rounds: avg (stddev)")
+    def opt(f, stat):
+        return None if stat is None else f(stat)
+    for p_id in sorted(completion_by_id,
+                       key=lambda id: opt(RunningStat.mean, completion_by_id[id]) or 0):
+        cs = completion_by_id[p_id]
+        print("%s: %s  (%s)" % (p_id, opt(RunningStat.mean, cs),
+                                opt(RunningStat.stddev, cs)))
+
+    if fairness.n > 0:
+        print("Fairness (Jain's index of share ratios): %.3f  (%.3f)" % (
+            fairness.mean(), fairness.stddev()))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
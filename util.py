@@ -44,6 +44,63 @@ def stddev(lst):
     return math.sqrt(sum((x-m)*(x-m) for x in lst) // len(lst))
 
 
+# Two-sided 95% critical values of Student's t, by degrees of freedom.
+_T95 = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+        2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110,
+        2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056,
+        2.052, 2.048, 2.045, 2.042]
+
+_Z975 = 1.959963984540054   # the normal distribution's 97.5% quantile
+
+def t95(df):
+    """Two-sided 95% critical value of Student's t with df degrees of freedom."""
+    if df < len(_T95):
+        return _T95[df]
+    # Past the table, the expansion of t in powers of 1/df (Abramowitz &
+    # Stegun 26.7.5) is good to about 1e-6.
+    z = _Z975
+    return (z + (z**3 + z) / (4.0 * df)
+            + (5*z**5 + 16*z**3 + 3*z) / (96.0 * df**2)
+            + (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / (384.0 * df**3))
+
+
+class RunningStat:
+    """
+    Single-pass mean and variance (Welford's algorithm), so a sequence of
+    values can be summarized without keeping it around.
+    """
+    def __init__(self):
+        self.n = 0
+        self._mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self._mean
+        self._mean += delta / self.n
+        self.m2 += delta * (x - self._mean)
+
+    def mean(self):
+        """Throws a div by zero exception if nothing was added"""
+        if self.n == 0:
+            raise ZeroDivisionError("mean of no values")
+        return self._mean
+
+    def stddev(self):
+        """Population standard deviation"""
+        if self.n == 0:
+            return 0
+        return math.sqrt(self.m2 / self.n)
+
+    def ci95(self):
+        """Half-width of the 95% confidence interval of the mean, or None
+        with fewer than two values."""
+        if self.n < 2:
+            return None
+        sample_var = self.m2 / (self.n - 1)
+        return t95(self.n - 1) * math.sqrt(sample_var / self.n)
+
+
 def median(numeric):
     vals = sorted(numeric)
     count = len(vals)
@@ -88,7 +145,8 @@ def even_split(n, k):
 
 def load_modules(agent_classes):
     """Each agent class must be in module class_name.lower().
-    Returns a dictionary class_name->class"""
+    Returns a dictionary class_name->class.  Repeated names are only
+    loaded once."""
 
     def load(class_name):
         module_name = class_name.lower()  # by convention / fiat
@@ -96,7 +154,7 @@ def load_modules(agent_classes):
         agent_class = module.__dict__[class_name]
         return (class_name, agent_class)
 
-    return dict(list(map(load, agent_classes)))
+    return dict(map(load, dict.fromkeys(agent_classes)))
     
 
 